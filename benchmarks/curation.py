@@ -0,0 +1,85 @@
+"""
+Curation time of large NEURON outputs.
+
+A synthetic `nrn_run` output mixing lines matched by the default curation
+patterns with plain simulation output is curated by a pass over all the lines
+per pattern (the former implementation) and by `modeldb.curation.Curator`,
+whose results must be equal.
+
+    python benchmarks/curation.py [--repeat=N] [--lines=N]
+"""
+
+import os
+import random
+import statistics
+import sys
+import time
+
+# run from a checkout: import the modeldb package next to this folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modeldb.curation import _default_patterns, Curator
+
+_sample_lines = (
+    "/usr/local/bin/nrniv: Assignment to modern physical constant FARADAY",
+    "./x86_64/special: Assignment to modern physical constant FARADAY",
+    'nrniv: unable to open font "*helvetica-medium-r-normal*--14*", using "fixed"',
+    "Fri Oct 16 10:01:02 UTC 2026",
+    "total run time 12.345",
+    "/usr/lib/python3.11/distutils/__init__.py:1: DeprecationWarning",
+    "  /opt/venv/lib/python3.11/site-packages/neuron/__init__.py:42: warning",
+    "",
+)
+
+
+def synthetic_output(lines):
+    rng = random.Random(0)
+    output = []
+    for i in range(lines):
+        if rng.random() < 0.1:
+            output.append(rng.choice(_sample_lines))
+        else:
+            output.append(
+                "t={:g} v={:.6f} ica={:.6e}".format(i * 0.025, -65 + i % 7, 1e-3)
+            )
+    return output
+
+
+def curate_per_pattern(patterns, lines):
+    for _, (regex, repl) in patterns.items():
+        lines = [line for line in (regex.sub(repl, line) for line in lines) if line]
+    return lines
+
+
+def timed(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def main(repeat=5, lines=200000):
+    output = synthetic_output(lines)
+    curator = Curator(_default_patterns)
+    per_pattern_time, expected = timed(
+        lambda: curate_per_pattern(_default_patterns, output), repeat
+    )
+    curator_time, curated = timed(lambda: curator.curate(output), repeat)
+    if curated != expected:
+        sys.exit("Curator output differs from the per pattern curation")
+    print("{} lines, {} curated".format(lines, len(curated)))
+    print("{:<20} {:.3f} s".format("per pattern", per_pattern_time))
+    print("{:<20} {:.3f} s".format("Curator", curator_time))
+
+
+if __name__ == "__main__":
+    repeat = 5
+    lines = 200000
+    for arg in sys.argv[1:]:
+        if arg.startswith("--repeat="):
+            repeat = int(arg.split("=", 1)[1])
+        elif arg.startswith("--lines="):
+            lines = int(arg.split("=", 1)[1])
+    main(repeat, lines)
@@ -0,0 +1,62 @@
+"""
+Startup time of the nrn-modeldb-ci console scripts.
+
+Every script is run with `-h` in a fresh interpreter, which measures the
+import of `modeldb.commands` plus whatever the script does before parsing its
+arguments. `python -c pass` is given as a reference.
+
+    python benchmarks/startup.py [--repeat=N]
+"""
+
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPTS = (
+    "runmodels",
+    "getmodels",
+    "diffgout",
+    "modeldb-config",
+    "report2html",
+    "diffreports2html",
+    "mergereports",
+    "convertgout",
+)
+
+_run_script = (
+    "import sys; from modeldb import commands; "
+    "getattr(commands, sys.argv[1].replace('-', '_'))(['-h'])"
+)
+
+
+def startup_time(cmds, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmds, stdout=subprocess.DEVNULL, check=False)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main(repeat=5):
+    print(
+        "{:<20} {:.3f} s".format(
+            "python -c pass", startup_time([sys.executable, "-c", "pass"], repeat)
+        )
+    )
+    for script in SCRIPTS:
+        print(
+            "{:<20} {:.3f} s".format(
+                script,
+                startup_time([sys.executable, "-c", _run_script, script], repeat),
+            )
+        )
+
+
+if __name__ == "__main__":
+    repeat = 5
+    for arg in sys.argv[1:]:
+        if arg.startswith("--repeat="):
+            repeat = int(arg.split("=", 1)[1])
+    main(repeat)
@@ -0,0 +1,230 @@
+"""
+Persistent caches of nrnivmodl output, keyed by mod file content and toolchain.
+
+Two layers are available:
+- the build cache stores the whole `x86_64` folder of a mod group
+- the object cache stores the nocmodl translation and object file of every
+  single mod file, so that mechanisms shipped by many models are translated and
+  compiled once. Note that the translated code records the path of the mod file
+  it was generated from (used by ModelView only); reused objects keep the path
+  of the first model that compiled them.
+"""
+
+import hashlib
+import os
+import platform
+import re
+import shlex
+import shutil
+import subprocess
+import sysconfig
+import tempfile
+from pathlib import Path
+
+from .config import *
+
+# Files living next to the .mod files that can end up in the compiled library,
+# either through NMODL `INCLUDE` statements or `#include` in VERBATIM blocks.
+MOD_AUX_SUFFIXES = (".inc", ".h", ".hpp", ".c", ".cpp")
+
+BUILD_LOG_FILE = "nrnivmodl.log"
+
+# nocmodl output (C for NEURON < 9, C++ since) and the compiled object
+MOD_OBJECT_SUFFIXES = (".c", ".cpp", ".o")
+
+_include_regex = re.compile(
+    r'^\s*(?:INCLUDE|#\s*include)\s*"([^"]+)"', re.MULTILINE
+)
+
+
+def _tool_version(cmds):
+    try:
+        return subprocess.run(
+            cmds,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def toolchain_fingerprint():
+    """
+    Identify the NEURON build and the C/C++ compilers used by nrnivmodl.
+
+    Like the NEURON wheel wrappers, honour CC/CXX from the environment and
+    fall back to the compilers Python was built with.
+    """
+    fingerprint = [
+        platform.machine(),
+        shutil.which("nrnivmodl") or "",
+        _tool_version(["nrniv", "--version"]),
+    ]
+    for var in ("CC", "CXX"):
+        compiler = os.environ.get(var) or sysconfig.get_config_var(var) or var.lower()
+        compiler = shlex.split(compiler)[0]
+        fingerprint.append(_tool_version([compiler, "--version"]))
+    return "\n".join(fingerprint)
+
+
+def mod_group_files(mods):
+    """
+    Return the .mod files of a group together with the auxiliary files next to
+    them and the files they include (wherever they are)
+    """
+    files = set(Path(mod) for mod in mods)
+    for mod_dir in {Path(mod).parent for mod in mods}:
+        files.update(
+            item
+            for item in mod_dir.iterdir()
+            if item.is_file() and item.suffix in MOD_AUX_SUFFIXES
+        )
+    for mod in mods:
+        files.update(Path(os.path.normpath(item)) for item in mod_file_includes(mod))
+    return sorted(files)
+
+
+def mod_group_key(mods, start_dir, toolchain):
+    """
+    Content hash of a mod group as compiled from `start_dir` with `toolchain`
+    """
+    sha = hashlib.sha256(toolchain.encode())
+    for item in mod_group_files(mods):
+        sha.update(os.path.relpath(item, start_dir).encode())
+        sha.update(b"\0")
+        sha.update(item.read_bytes())
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+def restore_build(key, start_dir):
+    """
+    Restore the compiled `x86_64` folder for `key` into `start_dir`.
+
+    Returns the nrnivmodl log lines recorded with the build, None on cache miss.
+    """
+    entry = os.path.join(MODELS_BUILD_CACHE_DIR, key)
+    if not os.path.isdir(entry):
+        return None
+    build_dir = os.path.join(start_dir, platform.machine())
+    shutil.rmtree(build_dir, ignore_errors=True)
+    shutil.copytree(os.path.join(entry, platform.machine()), build_dir, symlinks=True)
+    with open(os.path.join(entry, BUILD_LOG_FILE)) as log_file:
+        return log_file.read().split("\n")
+
+
+def store_build(key, start_dir, logs):
+    """
+    Store the compiled `x86_64` folder of `start_dir` under `key`.
+
+    Failed builds (no `special` produced) are not cached.
+    """
+    build_dir = os.path.join(start_dir, platform.machine())
+    if not os.path.isfile(os.path.join(build_dir, "special")):
+        return
+    os.makedirs(MODELS_BUILD_CACHE_DIR, exist_ok=True)
+    # several models may build the same group concurrently: populate a private
+    # directory and publish it with an atomic rename
+    tmp_entry = tempfile.mkdtemp(dir=MODELS_BUILD_CACHE_DIR, prefix=".tmp-")
+    try:
+        shutil.copytree(
+            build_dir, os.path.join(tmp_entry, platform.machine()), symlinks=True
+        )
+        with open(os.path.join(tmp_entry, BUILD_LOG_FILE), "w") as log_file:
+            log_file.write("\n".join(logs))
+        os.rename(tmp_entry, os.path.join(MODELS_BUILD_CACHE_DIR, key))
+    except OSError:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+
+
+def mod_file_includes(mod):
+    """
+    Files pulled in by a mod file (recursively) through INCLUDE or #include
+    """
+    includes = []
+    pending = [Path(mod)]
+    while pending:
+        current = pending.pop()
+        text = current.read_text(errors="replace")
+        for name in _include_regex.findall(text):
+            item = Path(mod).parent / name
+            if item.is_file() and item not in includes:
+                includes.append(item)
+                pending.append(item)
+    return sorted(includes)
+
+
+def mod_file_key(mod, toolchain):
+    """
+    Content hash of a single mod file (and the files it includes) for `toolchain`
+    """
+    sha = hashlib.sha256(toolchain.encode())
+    sha.update(Path(mod).name.encode())
+    sha.update(b"\0")
+    sha.update(Path(mod).read_bytes())
+    for item in mod_file_includes(mod):
+        sha.update(b"\0")
+        sha.update(os.path.relpath(item, Path(mod).parent).encode())
+        sha.update(b"\0")
+        sha.update(item.read_bytes())
+    return sha.hexdigest()
+
+
+def seed_mod_objects(keys, build_dir):
+    """
+    Copy cached translations and objects into `build_dir` ahead of nrnivmodl.
+
+    The copies are newer than the mod files, hence make considers them up to
+    date and skips both nocmodl and the compiler for them.
+    Returns the modification time of every seeded object, by mod file.
+    """
+    seeded = {}
+    for mod, key in keys.items():
+        entry = os.path.join(MODELS_OBJECT_CACHE_DIR, key)
+        if not os.path.isfile(os.path.join(entry, Path(mod).stem + ".o")):
+            continue
+        os.makedirs(build_dir, exist_ok=True)
+        # sources first, so that the object is the newest file
+        for suffix in MOD_OBJECT_SUFFIXES:
+            item = Path(mod).stem + suffix
+            if os.path.isfile(os.path.join(entry, item)):
+                shutil.copyfile(
+                    os.path.join(entry, item), os.path.join(build_dir, item)
+                )
+        seeded[mod] = os.stat(
+            os.path.join(build_dir, Path(mod).stem + ".o")
+        ).st_mtime_ns
+    return seeded
+
+
+def harvest_mod_objects(keys, build_dir, seeded):
+    """
+    Store freshly compiled objects of `build_dir` in the object cache.
+
+    Returns the number of mod files whose compilation was avoided (the seeded
+    object survived nrnivmodl untouched) and the number of mod files compiled.
+    """
+    hits = misses = 0
+    for mod, key in keys.items():
+        obj = os.path.join(build_dir, Path(mod).stem + ".o")
+        if not os.path.isfile(obj):
+            misses += 1
+            continue
+        if mod in seeded and os.stat(obj).st_mtime_ns == seeded[mod]:
+            hits += 1
+            continue
+        misses += 1
+        os.makedirs(MODELS_OBJECT_CACHE_DIR, exist_ok=True)
+        tmp_entry = tempfile.mkdtemp(dir=MODELS_OBJECT_CACHE_DIR, prefix=".tmp-")
+        try:
+            for suffix in MOD_OBJECT_SUFFIXES:
+                item = Path(mod).stem + suffix
+                if os.path.isfile(os.path.join(build_dir, item)):
+                    shutil.copyfile(
+                        os.path.join(build_dir, item), os.path.join(tmp_entry, item)
+                    )
+            os.rename(tmp_entry, os.path.join(MODELS_OBJECT_CACHE_DIR, key))
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+    return hits, misses
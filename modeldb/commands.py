@@ -1,9 +1,11 @@
 import inspect
 import json
 import os
+import re
 import shlex
 import subprocess
 import sys
+import tempfile
 from pathlib import Path
 from pprint import pprint
 
@@ -12,10 +14,16 @@ from jinja2 import Environment
 from jinja2 import FileSystemLoader
 
 from .config import *
-from .modeldb import ModelDB
+from .gout import convert_gout
+from .gout import GOUT_ATOL
+from .gout import GOUT_RTOL
+from .gout import is_binary_gout
+from .modeldb import DOWNLOAD_JOBS
+from .modeldb import shared_modeldb
 from .modelrun import is_dir_non_empty
 from .modelrun import ModelRunManager
 from .report import diff_reports
+from .report import merge_reports
 
 
 def runmodels(args=None):
@@ -33,23 +41,72 @@ def runmodels(args=None):
 
     Options:
         --gout                  Include gout into the report. Note that gout data can be very big, so disabled by default.
+        --gout-format=<FORMAT>  Format of the gout files written by the models: `text` (default) or `binary` (see convertgout).
         --virtual               Run in headless mode. You need a back-end like Xvfb.
         --clean                 Auto-clean model working directory before running (useful for consecutive runs and failsafe)
         --norun                 Compile and link only (nrnivmodl).
         --inplace               Skip model preparation logic, simply run NEURON.
+        --build-cache           Reuse compiled mechanisms (nrnivmodl output) from a persistent cache keyed by mod files, NEURON version and compilers.
+        --object-cache          Translate and compile every distinct mod file once, across models and runs (per mod file object cache).
+        --extract-cache         Extract every model zip once into a persistent cache and hard link the files into --workdir.
+        --scratch=<PATH>        Prepare, compile and run every model in PATH/<model_id> (e.g. on /dev/shm), then only copy the files referenced by the report (gout, run_info, nrn_run.log) to --workdir.
+        --scratch-keep-build    With --scratch, also copy the compiled mechanisms (x86_64 folder) to --workdir.
+        --jobs=<N>              Number of cores shared by model runs and nrnivmodl builds (default: number of CPUs).
+        --history=<REPORTS>     Comma separated json reports of previous runs used to schedule the longest models first (on top of the persisted run time history).
+        --timeout=<SECONDS>     Default wall-clock limit for a model (preparation, nrnivmodl and NEURON run); `timeout` in modeldb-run.yaml overrides it.
+        --max-memory=<MB>       Default address space limit of every model subprocess; `max_memory` in modeldb-run.yaml overrides it.
+        --reuse-results         Reuse the results of previous runs for models whose inputs (zip, modeldb-run.yaml entry, NEURON build and run options) did not change.
+        --shard=<K/N>           Only run the K-th (1 to N) of N shards of the models, balanced by their expected run times. Shards are balanced with the run times of the --history reports only (not the persisted run time history): give all shards the same --history to partition the models identically.
+        --runner=<RUNNER>       How models are run: `pool` of worker processes (default) or `asyncio` subprocesses driven from a single process; both run at most --jobs models at a time.
+        --resume                Resume an interrupted run in --workdir: skip the models already in its <workdir>.jsonl report for the same NEURON version (implies --clean unless --inplace).
 
     Examples
         runmodels --workdir=/path/to/workdir                        # run all models
         runmodels --clean --workdir=/path/to/workdir 23613 12344    # run models 23613 & 12344
+        runmodels --resume --workdir=/path/to/workdir               # finish an interrupted run
     """
     options = docopt(runmodels.__doc__, args)
     working_dir = options.pop("--workdir")
     model_ids = [int(model_id) for model_id in options.pop("<model_id>")]
     gout = options.pop("--gout", False)
+    gout_format = options.pop("--gout-format", None) or "text"
+    if gout_format not in ("text", "binary"):
+        print("ERROR: --gout-format must be one of text, binary")
+        sys.exit(1)
     virtual = options.pop("--virtual", False)
     clean = options.pop("--clean", False)
     norun = options.pop("--norun", False)
     inplace = options.pop("--inplace", False)
+    build_cache = options.pop("--build-cache", False)
+    object_cache = options.pop("--object-cache", False)
+    extract_cache = options.pop("--extract-cache", False)
+    scratch = options.pop("--scratch", None)
+    scratch_keep_build = options.pop("--scratch-keep-build", False)
+    jobs = options.pop("--jobs", None)
+    jobs = int(jobs) if jobs else None
+    history = options.pop("--history", None)
+    history = history.split(",") if history else ()
+    timeout = options.pop("--timeout", None)
+    timeout = float(timeout) if timeout else None
+    max_memory = options.pop("--max-memory", None)
+    max_memory = int(max_memory) if max_memory else None
+    resume = options.pop("--resume", False)
+    reuse_results = options.pop("--reuse-results", False)
+    runner = options.pop("--runner", None) or "pool"
+    if runner not in ("pool", "asyncio"):
+        print("ERROR: --runner must be one of pool, asyncio")
+        sys.exit(1)
+    shard = options.pop("--shard", None)
+    if shard:
+        match = re.fullmatch(r"(\d+)/(\d+)", shard)
+        if match is None or not 1 <= int(match[1]) <= int(match[2]):
+            print(
+                "ERROR: --shard={} : expected K/N with 1 <= K <= N (e.g. 1/4)".format(
+                    shard
+                )
+            )
+            sys.exit(1)
+        shard = (int(match[1]) - 1, int(match[2]))
 
     if os.path.abspath(working_dir) == ROOT_DIR:
         print(
@@ -59,10 +116,18 @@ def runmodels(args=None):
         )
         sys.exit(1)
 
+    if scratch and os.path.abspath(scratch) == os.path.abspath(working_dir):
+        print("ERROR: --scratch must be another directory than --workdir")
+        sys.exit(1)
+
     if clean and inplace:
         print("ERROR: --clean and --inplace are mutually exclusive")
         sys.exit(1)
 
+    # models interrupted mid-run are prepared again from scratch
+    if resume and not inplace:
+        clean = True
+
     if not (clean or inplace) and is_dir_non_empty(working_dir):
         print("ERROR: WorkingDirectory {} exists and is non empty.".format(working_dir))
         print(
@@ -73,7 +138,25 @@ def runmodels(args=None):
         sys.exit(1)
 
     mrm = ModelRunManager(
-        working_dir, gout=gout, clean=clean, norun=norun, inplace=inplace
+        working_dir,
+        gout=gout,
+        gout_format=gout_format,
+        clean=clean,
+        norun=norun,
+        inplace=inplace,
+        build_cache=build_cache,
+        object_cache=object_cache,
+        extract_cache=extract_cache,
+        scratch=scratch,
+        scratch_keep_build=scratch_keep_build,
+        jobs=jobs,
+        history=history,
+        timeout=timeout,
+        max_memory=max_memory,
+        resume=resume,
+        reuse_results=reuse_results,
+        shard=shard,
+        runner=runner,
     )
     model_list = model_ids if model_ids else None
 
@@ -92,21 +175,27 @@ def getmodels(args=None):
     Retrieve all or specified models from ModelDB.
 
     Usage:
-        getmodels [<model_id>...]
+        getmodels [options] [<model_id>...]
         getmodels -h
 
     Arguments:
         model_id=<n>           Optional: ModelDB accession number(s) to download; default is all available models
 
+    Options:
+        --jobs=<N>             Number of concurrent downloads (default: 8).
+
     Examples
         getmodels
         getmodels 23613 12344
     """
     options = docopt(getmodels.__doc__, args)
     model_ids = [int(model_id) for model_id in options.pop("<model_id>")]
+    jobs = options.pop("--jobs", None)
 
-    mdb = ModelDB()
-    mdb.download_models(model_list=model_ids if model_ids else None)
+    shared_modeldb().download_models(
+        model_list=model_ids if model_ids else None,
+        jobs=int(jobs) if jobs else DOWNLOAD_JOBS,
+    )
 
 
 def diffgout(args=None):
@@ -122,20 +211,98 @@ def diffgout(args=None):
         goutFile1=PATH      Required: file path to first gout file
         goutFile2=PATH      Required: file path to second gout file
 
+    Binary gout files are converted to text into temporary files first.
+
     Examples
         diffgout 3246-master/varela/gout 3246-8.0.2/varela/gout
 
     """
     options = docopt(diffgout.__doc__, args)
 
-    gout_file1 = options.pop("<goutFile1>")
-    gout_file2 = options.pop("<goutFile2>")
+    gout_files = [options.pop(key) for key in ("<goutFile1>", "<goutFile2>")]
 
-    cmd = 'nrngui -c "strdef gout1" -c "gout1=\\"{}\\"" -c "strdef gout2" -c "gout2=\\"{}\\"" modeldb/showgout.hoc'.format(
-        gout_file1, gout_file2
-    )
-    commands = shlex.split(cmd)
-    _ = subprocess.Popen(commands)
+    with tempfile.TemporaryDirectory(prefix="gout-") as tmp_dir:
+        gout_file1, gout_file2 = (
+            _text_gout(gout_file, os.path.join(tmp_dir, str(i)))
+            for i, gout_file in enumerate(gout_files)
+        )
+        cmd = 'nrngui -c "strdef gout1" -c "gout1=\\"{}\\"" -c "strdef gout2" -c "gout2=\\"{}\\"" modeldb/showgout.hoc'.format(
+            gout_file1, gout_file2
+        )
+        commands = shlex.split(cmd)
+        process = subprocess.Popen(commands)
+        # converted files are deleted with tmp_dir, once nrngui is closed
+        if os.listdir(tmp_dir):
+            process.wait()
+
+
+def _text_gout(gout_file, text_file):
+    """
+    `gout_file` if it is in text format, else its conversion to `text_file`
+    """
+    if not is_binary_gout(gout_file):
+        return gout_file
+    convert_gout(gout_file, text_file, binary=False)
+    return text_file
+
+
+def convertgout(args=None):
+    """convertgout
+
+        Convert a gout file between the text and binary formats (see runmodels --gout-format)
+
+    Usage:
+        convertgout (--text | --binary) <goutFile> <output>
+        convertgout -h      Print help
+
+    Arguments:
+        goutFile=PATH       Required: gout file to convert (text or binary)
+        output=PATH         Required: converted gout file to write
+
+    Options:
+        --text              Write the text format, as read by showgout.hoc and diffgout.
+        --binary            Write the binary format.
+
+    Examples
+        convertgout --text 3246-master/varela/gout varela-gout.txt
+    """
+    options = docopt(convertgout.__doc__, args)
+    convert_gout(options["<goutFile>"], options["<output>"], options["--binary"])
+
+
+def mergereports(args=None):
+    """mergereports
+
+        Merge the json reports of runmodels shards (see runmodels --shard) into one report.
+
+    Usage:
+        mergereports --output=<PATH> [options] <json_report>...
+        mergereports -h         Print help
+
+    Arguments:
+        --output=<PATH>        Required: merged json report to write
+        json_report=PATH       Required: json reports following runmodels (same NEURON version)
+
+    Options:
+        --models=<IDS>         Comma separated models that the shards were run for (default: all available models); those found in no report are listed in the `Missing models` stats.
+
+    Examples
+        mergereports --output=master.json master-1.json master-2.json master-3.json
+
+    """
+    options = docopt(mergereports.__doc__, args)
+
+    output = options.pop("--output")
+    json_reports = options.pop("<json_report>")
+    model_ids = options.pop("--models", None)
+    if model_ids:
+        model_ids = [int(model_id) for model_id in model_ids.split(",")]
+
+    merged = merge_reports(json_reports, model_ids)
+    print("Writing {} ...".format(output))
+    with open(output, "w") as fh:
+        json.dump(merged, fh, indent=4, sort_keys=True)
+    print("Done.")
 
 
 def modeldb_config(args=None):
@@ -218,13 +385,18 @@ def diffreports2html(args=None):
         Note that you should have the gout files present if you want to diff them.
 
     Usage:
-        diffreports2html <json_report1> <json_report2>
+        diffreports2html [options] <json_report1> <json_report2>
         diffreports2html -h         Print help
 
     Arguments:
         json_report1=PATH      Required: json report file following runmodels for NEURON version 1
         json_report2=PATH      Required: json report file following runmodels for NEURON version 2
 
+    Options:
+        --gout-atol=<ATOL>     Absolute tolerance of the gout comparison (default: 1e-8); `gout_atol` in modeldb-run.yaml overrides it.
+        --gout-rtol=<RTOL>     Relative tolerance of the gout comparison (default: 1e-5); `gout_rtol` in modeldb-run.yaml overrides it.
+        --jobs=<N>             Number of processes comparing the models (default: number of CPUs).
+
     Examples
         diffreport2html 3246-master.json 3246-8.0.2.json
 
@@ -233,6 +405,12 @@ def diffreports2html(args=None):
 
     json_report1 = options.pop("<json_report1>")
     json_report2 = options.pop("<json_report2>")
+    gout_atol = options.pop("--gout-atol", None)
+    gout_atol = float(gout_atol) if gout_atol else GOUT_ATOL
+    gout_rtol = options.pop("--gout-rtol", None)
+    gout_rtol = float(gout_rtol) if gout_rtol else GOUT_RTOL
+    jobs = options.pop("--jobs", None)
+    jobs = int(jobs) if jobs else None
 
     file_loader = FileSystemLoader(
         os.path.join(Path(__file__).parent.resolve(), "templates")
@@ -253,7 +431,11 @@ def diffreports2html(args=None):
         Path(json_report1).resolve().parent, "runtimes-" + report_title + ".html"
     )
     diff_dict, gout_dict, runtime_dict, stats_dict, v1, v2 = diff_reports(
-        json_report1, json_report2
+        json_report1,
+        json_report2,
+        gout_atol=gout_atol,
+        gout_rtol=gout_rtol,
+        jobs=jobs,
     )
 
     print("Writing {} ...".format(report_filename))
@@ -307,6 +489,18 @@ def diffreports2html(args=None):
             )
         )
         code = 1
+    # reports produced before timeouts were introduced have no such entry
+    total_timeouts = sum(
+        version_stats.get("Timed out runs", {"Count": 0})["Count"]
+        for version_stats in stats_dict.values()
+    )
+    if total_timeouts > 0:
+        print(
+            "FAILURE: there were {} timed out model runs across {} versions of NEURON".format(
+                total_timeouts, len(stats_dict)
+            )
+        )
+        code = 1
     # These are not expected to be different between the two NEURON versions tested
     assert (
         len(
@@ -13,4 +13,12 @@ ROOT_DIR = os.path.abspath(__file__ + "/../../")
 MODELS_ZIP_DIR = "%s/cache" % ROOT_DIR
 MODELDB_ROOT_DIR = "%s/modeldb" % ROOT_DIR
 MODELDB_METADATA_FILE = "%s/modeldb-meta.yaml" % MODELDB_ROOT_DIR
+MODELDB_METADATA_DB = "%s/modeldb-meta.db" % MODELDB_ROOT_DIR
 MODELDB_RUN_FILE = "%s/modeldb-run.yaml" % MODELDB_ROOT_DIR
+MODELDB_RUN_INDEX_FILE = "%s/modeldb-run.pickle" % MODELS_ZIP_DIR
+MODELS_BUILD_CACHE_DIR = "%s/build-cache" % ROOT_DIR
+MODELS_OBJECT_CACHE_DIR = "%s/object-cache" % ROOT_DIR
+MODELS_RESULT_CACHE_DIR = "%s/result-cache" % ROOT_DIR
+MODELS_EXTRACT_CACHE_DIR = "%s/extract-cache" % ROOT_DIR
+MODELDB_RUNTIME_HISTORY_FILE = "%s/runtime-history.json" % MODELS_ZIP_DIR
+MODELDB_SYNC_STATE_FILE = "%s/sync-state.json" % MODELS_ZIP_DIR
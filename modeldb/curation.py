@@ -0,0 +1,128 @@
+"""
+Curation of the NEURON output of model runs, before comparing two runs.
+
+Every line goes once through the substitutions of a Curator, in order; lines
+emptied by a substitution are dropped. A substitution is only attempted on the
+lines containing the longest literal its pattern requires (e.g.
+`site-packages/`), which skips most regex searches on large logs.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import re
+
+from .modeldb import shared_modeldb
+
+try:
+    from re import _constants as _sre_constants
+    from re import _parser as _sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants as _sre_constants
+    import sre_parse as _sre_parse
+
+# default curation of the NEURON output: replacement by pattern
+CURATE_PATTERNS = {
+    # /../nrniv: Assignment to modern physical constant FARADAY	<-> ./x86_64/special: Assignment to modern physical constant FARADAY
+    "^/.*?/nrniv:": "%neuron-executable%:",
+    "^\\./x86_64/special:": "%neuron-executable%:",
+    # nrniv: unable to open font "*helvetica-medium-r-normal*--14*", using "fixed" <-> special: unableto open font "*helvetica-medium-r-normal*--14*", using "fixed"
+    "^nrniv:": "%neuron-executable%:",
+    "^special:": "%neuron-executable%:",
+    "(Mon|Tue|Wed|Thu|Fri|Sat|Sun) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d+\s+\d+:\d+:\d+ [A-Z\s]+ \d+": "%date_command%",
+    "total run time [0-9\.]+": "total run time %run_time%",
+    "(^.*distutils.*$)": "",
+    "/.*?/lib/python.*/site-packages/": "%python-site-packages%",
+}
+
+
+def required_literal(regex):
+    """
+    Longest string that every match of the compiled `regex` contains, None if
+    there is none (or it cannot be told)
+    """
+    if regex.flags & re.IGNORECASE:
+        return None
+    try:
+        items = list(_sre_parse.parse(regex.pattern, regex.flags))
+    except Exception:  # noqa
+        return None
+    # consecutive literals of the top level sequence are all matched
+    literals = [""]
+    for op, value in items:
+        if op is _sre_constants.LITERAL:
+            literals[-1] += chr(value)
+        else:
+            literals.append("")
+    return max(literals, key=len) or None
+
+
+class Curator(object):
+    """Ordered substitutions applied to every line of a run output"""
+
+    def __init__(self, patterns):
+        # (pattern, regex, replacement, literal prefilter)
+        self._substitutions = [
+            (pattern, regex, repl, required_literal(regex))
+            for pattern, (regex, repl) in patterns.items()
+        ]
+        # identifies the substitutions, in the reports of the curated outputs
+        substitutions = [
+            (regex.pattern, regex.flags, repl)
+            for _, regex, repl, _ in self._substitutions
+        ]
+        self.key = hashlib.sha256(json.dumps(substitutions).encode()).hexdigest()
+
+    def curate(self, lines):
+        if not self._substitutions:
+            return list(lines)
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        curated = []
+        for line in lines:
+            for pattern, regex, repl, literal in self._substitutions:
+                if literal is None or literal in line:
+                    new_line, number_of_subs = regex.subn(repl, line)
+                    if number_of_subs and debug:
+                        logging.debug(
+                            "{} matched {} time(s)".format(pattern, number_of_subs)
+                        )
+                        logging.debug("{} -> {}".format(line, new_line))
+                    line = new_line
+                if not line:
+                    break
+            # if we are replacing a full line with an empty string, don't add it to the curated data
+            if line:
+                curated.append(line)
+        return curated
+
+    def fingerprint(self, lines):
+        """sha256 of the curated `lines`"""
+        sha = hashlib.sha256()
+        for line in self.curate(lines):
+            sha.update(line.encode() + b"\n")
+        return sha.hexdigest()
+
+
+_default_patterns = {
+    pattern: (re.compile(pattern), repl) for pattern, repl in CURATE_PATTERNS.items()
+}
+
+
+def model_curator(model_patterns):
+    """
+    Curator of the default patterns, overridden and followed by the compiled
+    `model_patterns` ({pattern: (regex, repl)})
+    """
+    patterns = dict(_default_patterns)
+    patterns.update(model_patterns)
+    return Curator(patterns)
+
+
+@functools.lru_cache(maxsize=None)
+def curator(model=None):
+    """
+    Curator of the run output of `model` (default patterns plus its
+    `curate_patterns` in modeldb-run.yaml), built once per process
+    """
+    return model_curator(shared_modeldb().run_instr.curate_patterns(model))
@@ -1,9 +1,22 @@
+import hashlib
+
+
+def file_sha256(path):
+    """sha256 of the file at `path`, read by chunks"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
 class Model(object):
-    def __init__(self, object_id, name, created, ver_date):
+    def __init__(self, object_id, name, created, ver_date, sha256=None):
         self._object_id = object_id
         self._name = name
         self._created = created
         self._ver_date = ver_date
+        self._sha256 = sha256
 
     @property
     def id(self):
@@ -12,3 +25,9 @@ class Model(object):
     name = property(lambda self: self._name)
     created = property(lambda self: self._created)
     last_modified = property(lambda self: self._ver_date)
+
+    # checksum of the cached zip; metadata saved by older versions have none
+    def _set_sha256(self, sha256):
+        self._sha256 = sha256
+
+    sha256 = property(lambda self: getattr(self, "_sha256", None), _set_sha256)
@@ -0,0 +1,136 @@
+"""
+Persistent cache of extracted model zips, keyed by the sha256 of the zip.
+
+Every zip is decompressed once into MODELS_EXTRACT_CACHE_DIR; working
+directories are then populated with hard links to the cached files (copies
+when linking is not possible, e.g. across filesystems).
+
+A file written in place through a hard link also changes the cached copy. The
+size and mtime of every cached file are recorded in a manifest and checked
+before each use: an entry modified that way is discarded and extracted again.
+Models with a `script` get copies, since scripts commonly edit model files.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+from .config import *
+from .data import file_sha256
+
+EXTRACT_MANIFEST_FILE = "manifest.json"
+EXTRACT_TREE_DIR = "tree"
+
+
+def zip_key(model):
+    """
+    sha256 of the zip of `model`, as recorded by `getmodels` when available
+    """
+    if model.sha256 is not None:
+        return model.sha256
+    return file_sha256(os.path.join(MODELS_ZIP_DIR, "{}.zip".format(model.id)))
+
+
+def _stat_manifest(tree):
+    manifest = {"dirs": [], "files": {}}
+    for root, dirs, files in os.walk(tree):
+        for name in dirs:
+            manifest["dirs"].append(os.path.relpath(os.path.join(root, name), tree))
+        for name in files:
+            path = os.path.join(root, name)
+            stat = os.lstat(path)
+            manifest["files"][os.path.relpath(path, tree)] = [
+                stat.st_size,
+                stat.st_mtime_ns,
+            ]
+    manifest["dirs"].sort()
+    return manifest
+
+
+def _load_entry(entry):
+    """
+    Manifest of the cache `entry`, None if missing or no longer matching the
+    cached files
+    """
+    try:
+        with open(os.path.join(entry, EXTRACT_MANIFEST_FILE)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+    tree = os.path.join(entry, EXTRACT_TREE_DIR)
+    for name, (size, mtime_ns) in manifest["files"].items():
+        try:
+            stat = os.lstat(os.path.join(tree, name))
+        except OSError:
+            return None
+        if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+            return None
+    return manifest
+
+
+def _store_entry(zip_ref, entry):
+    os.makedirs(MODELS_EXTRACT_CACHE_DIR, exist_ok=True)
+    # several processes may extract the same zip: populate a private
+    # directory and publish it with an atomic rename
+    tmp_entry = tempfile.mkdtemp(dir=MODELS_EXTRACT_CACHE_DIR, prefix=".tmp-")
+    try:
+        tree = os.path.join(tmp_entry, EXTRACT_TREE_DIR)
+        zip_ref.extractall(tree)
+        manifest = _stat_manifest(tree)
+        with open(os.path.join(tmp_entry, EXTRACT_MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f)
+        if os.path.isdir(entry):
+            # stale entry: move it out of the way before deleting it
+            stale_entry = tempfile.mkdtemp(
+                dir=MODELS_EXTRACT_CACHE_DIR, prefix=".stale-"
+            )
+            os.rename(entry, os.path.join(stale_entry, "entry"))
+            shutil.rmtree(stale_entry, ignore_errors=True)
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # lost the race against another process, or the cache is not writable
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        return _load_entry(entry)
+    return manifest
+
+
+def _place_file(src, dst, link):
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
+def extract_model(zip_ref, key, dest, link=True, private=()):
+    """
+    Populate `dest` with the content of `zip_ref` from the cache entry `key`.
+
+    Files are hard linked when `link` is set, except the ones named in
+    `private` (file names, in any directory) that are always copied. Returns
+    whether the cache entry could be used as is.
+    """
+    entry = os.path.join(MODELS_EXTRACT_CACHE_DIR, key)
+    manifest = _load_entry(entry)
+    hit = manifest is not None
+    if not hit:
+        manifest = _store_entry(zip_ref, entry)
+    if manifest is None:
+        zip_ref.extractall(dest)
+        return False
+    tree = os.path.join(entry, EXTRACT_TREE_DIR)
+    os.makedirs(dest, exist_ok=True)
+    for name in manifest["dirs"]:
+        os.makedirs(os.path.join(dest, name), exist_ok=True)
+    for name in manifest["files"]:
+        _place_file(
+            os.path.join(tree, name),
+            os.path.join(dest, name),
+            link and os.path.basename(name) not in private,
+        )
+    return hit
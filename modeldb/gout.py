@@ -0,0 +1,398 @@
+"""
+Readers, writers and converters of the `gout` files written by `verify_graph_()`.
+
+Two formats exist, made of the same records (one per `verify_graph_()` call):
+
+- text, as read by `showgout.hoc`/`diffgout`:
+
+      Graphs <number of graphs>
+      <graph name>
+      lines <number of lines>
+      points <number of points>
+      xvec<line index>
+      <one %g value per line, then an empty line>
+      yvec<line index>
+      <one %g value per line, then an empty line>
+
+- binary (`runmodels --gout-format=binary`): a `GOUTB 1` first line, then the
+  same headers with the values as `Vector.vwrite` blocks: the number of values
+  and a type code (native int32), then the values (native float64).
+
+Binary files are memory-mapped: the coordinates are NumPy arrays backed by the
+file and are not copied.
+"""
+
+import collections
+import hashlib
+import mmap
+import os
+import zlib
+
+import numpy as np
+
+GOUT_BINARY_MAGIC = b"GOUTB 1\n"
+
+# Default tolerances of compare_gout (those of numpy.isclose): ignore the
+# last digit changes of the %g text format
+GOUT_ATOL = 1e-8
+GOUT_RTOL = 1e-5
+# Differences listed by compare_gout
+GOUT_MAX_DIFFERENCES = 30
+
+GoutGraph = collections.namedtuple("GoutGraph", "name lines")
+GoutLine = collections.namedtuple("GoutLine", "index x y")
+
+# Vector.vwrite type codes
+_vwrite_dtypes = {
+    1: np.int8,
+    2: np.int16,
+    3: np.float32,
+    4: np.float64,
+    5: np.int32,
+}
+_vwrite_header = np.dtype([("size", np.int32), ("type", np.int32)])
+
+
+class GoutFormatError(Exception):
+    """Malformed gout file"""
+
+
+def is_binary_gout(path):
+    with open(path, "rb") as gout_file:
+        return gout_file.read(len(GOUT_BINARY_MAGIC)) == GOUT_BINARY_MAGIC
+
+
+class _BinaryReader(object):
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._pos = len(GOUT_BINARY_MAGIC)
+
+    at_end = property(lambda self: self._pos >= len(self._buffer))
+
+    def line(self):
+        end = self._buffer.find(b"\n", self._pos)
+        if end == -1:
+            raise GoutFormatError("truncated header at byte {}".format(self._pos))
+        line = self._buffer[self._pos : end].decode()
+        self._pos = end + 1
+        return line
+
+    def values(self):
+        header = np.frombuffer(
+            self._buffer, dtype=_vwrite_header, count=1, offset=self._pos
+        )[0]
+        if int(header["type"]) not in _vwrite_dtypes:
+            raise GoutFormatError(
+                "unknown type code {} at byte {}".format(header["type"], self._pos)
+            )
+        dtype = np.dtype(_vwrite_dtypes[int(header["type"])])
+        offset = self._pos + _vwrite_header.itemsize
+        self._pos = offset + int(header["size"]) * dtype.itemsize
+        if self._pos > len(self._buffer):
+            raise GoutFormatError("truncated values at byte {}".format(offset))
+        return np.frombuffer(
+            self._buffer, dtype=dtype, count=int(header["size"]), offset=offset
+        )
+
+
+class _TextReader(object):
+    def __init__(self, text):
+        self._lines = text.split("\n")
+        self._pos = 0
+
+    # ignore the trailing newline(s)
+    at_end = property(lambda self: not any(self._lines[self._pos :]))
+
+    def line(self):
+        if self._pos >= len(self._lines):
+            raise GoutFormatError("truncated file at line {}".format(self._pos))
+        self._pos += 1
+        return self._lines[self._pos - 1]
+
+    def values(self, size):
+        values = np.array(self._lines[self._pos : self._pos + size], dtype=np.float64)
+        # values are followed by an empty line
+        self._pos += size + 1
+        return values
+
+
+def _value(line, keyword):
+    if not line.startswith(keyword):
+        raise GoutFormatError("expected `{}`, got `{}`".format(keyword, line))
+    return int(line[len(keyword) :])
+
+
+def _read_records(reader, binary):
+    records = []
+    while not reader.at_end:
+        graphs = []
+        for _ in range(_value(reader.line(), "Graphs ")):
+            name = reader.line()
+            lines = []
+            for _ in range(_value(reader.line(), "lines ")):
+                size = _value(reader.line(), "points ")
+                index = _value(reader.line(), "xvec")
+                x = reader.values() if binary else reader.values(size)
+                _value(reader.line(), "yvec")
+                y = reader.values() if binary else reader.values(size)
+                lines.append(GoutLine(index, x, y))
+            graphs.append(GoutGraph(name, lines))
+        records.append(graphs)
+    return records
+
+
+def read_gout(path):
+    """
+    Records of the gout file at `path` (text or binary): for every call of
+    `verify_graph_()`, a list of GoutGraph whose lines hold NumPy arrays
+    """
+    if is_binary_gout(path):
+        if os.path.getsize(path) == len(GOUT_BINARY_MAGIC):
+            return []
+        with open(path, "rb") as gout_file:
+            buffer = mmap.mmap(gout_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return _read_records(_BinaryReader(buffer), binary=True)
+    with open(path) as gout_file:
+        return _read_records(_TextReader(gout_file.read()), binary=False)
+
+
+def _text_values(values):
+    return "".join("%g\n" % value for value in values.tolist())
+
+
+def _iter_text(records):
+    for graphs in records:
+        yield "Graphs {}\n".format(len(graphs))
+        for graph in graphs:
+            yield "{}\n".format(graph.name)
+            yield "lines {}\n".format(len(graph.lines))
+            for line in graph.lines:
+                yield "points {}\n".format(len(line.x))
+                for name, values in (("xvec", line.x), ("yvec", line.y)):
+                    yield "{}{}\n".format(name, line.index)
+                    yield _text_values(values)
+                    yield "\n"
+
+
+def gout_text_lines(path):
+    """
+    Lines of the gout file at `path` in text format, as from `readlines()`
+    """
+    if not is_binary_gout(path):
+        with open(path) as gout_file:
+            return gout_file.readlines()
+    return "".join(_iter_text(read_gout(path))).splitlines(keepends=True)
+
+
+def write_text_gout(records, path):
+    with open(path, "w") as gout_file:
+        gout_file.writelines(_iter_text(records))
+
+
+def write_binary_gout(records, path):
+    with open(path, "wb") as gout_file:
+        gout_file.write(GOUT_BINARY_MAGIC)
+        for graphs in records:
+            gout_file.write("Graphs {}\n".format(len(graphs)).encode())
+            for graph in graphs:
+                gout_file.write("{}\n".format(graph.name).encode())
+                gout_file.write("lines {}\n".format(len(graph.lines)).encode())
+                for line in graph.lines:
+                    gout_file.write("points {}\n".format(len(line.x)).encode())
+                    for name, values in (("xvec", line.x), ("yvec", line.y)):
+                        gout_file.write("{}{}\n".format(name, line.index).encode())
+                        np.array([(len(values), 4)], dtype=_vwrite_header).tofile(
+                            gout_file
+                        )
+                        np.asarray(values, dtype=np.float64).tofile(gout_file)
+
+
+def convert_gout(src, dst, binary):
+    """
+    Write the gout file `src` (text or binary) to `dst` in binary format if
+    `binary` is set, in text format otherwise
+    """
+    records = read_gout(src)
+    if binary:
+        write_binary_gout(records, dst)
+    else:
+        write_text_gout(records, dst)
+
+
+def _bounds(values):
+    if not len(values):
+        return None, None
+    return float(np.min(values)), float(np.max(values))
+
+
+def gout_fingerprint(path):
+    """
+    sha256 of the gout file at `path` (its headers and its values as float64)
+    and a summary of every graph line: its position (sim, graph, line), number
+    of points, min/max of x and y, and the crc32 of its coordinates as float64.
+
+    The values are hashed as they are read, without formatting them: a text
+    and a binary gout of the same run only get the same hash when the values
+    have an exact %g representation.
+    """
+    records = read_gout(path)
+    sha = hashlib.sha256()
+    summary = []
+    for sim, graphs in enumerate(records, 1):
+        sha.update("Graphs {}\n".format(len(graphs)).encode())
+        for ig, graph in enumerate(graphs):
+            sha.update("{}\nlines {}\n".format(graph.name, len(graph.lines)).encode())
+            for il, line in enumerate(graph.lines):
+                x = np.ascontiguousarray(line.x, dtype=np.float64)
+                y = np.ascontiguousarray(line.y, dtype=np.float64)
+                sha.update("points {} {}\n".format(len(x), line.index).encode())
+                sha.update(x)
+                sha.update(y)
+                summary.append(
+                    {
+                        "line": [sim, ig, il],
+                        "points": len(x),
+                        "x": _bounds(x),
+                        "y": _bounds(y),
+                        "crc32": zlib.crc32(y, zlib.crc32(x)),
+                    }
+                )
+    return sha.hexdigest(), summary
+
+
+def _compare_bounds(where, label, a, b, atol, rtol):
+    if None in a or None in b:
+        return None if list(a) == list(b) else "{} {}: no points".format(where, label)
+    if np.isclose(a, b, rtol=rtol, atol=atol, equal_nan=True).all():
+        return None
+    return "{} {}: range [{:g}, {:g}] vs [{:g}, {:g}]".format(where, label, *a, *b)
+
+
+def _iter_summary_differences(summary_a, summary_b, atol, rtol, compare_crc):
+    lines_a = {tuple(line["line"]): line for line in summary_a}
+    lines_b = {tuple(line["line"]): line for line in summary_b}
+    for key in sorted(lines_a.keys() | lines_b.keys()):
+        where = "sim {} graph {} line {}".format(*key)
+        if key not in lines_a or key not in lines_b:
+            yield "{} missing in {}".format(where, "a" if key not in lines_a else "b")
+            continue
+        line_a, line_b = lines_a[key], lines_b[key]
+        if line_a["points"] != line_b["points"]:
+            yield "{} has {}/{} points".format(
+                where, line_a["points"], line_b["points"]
+            )
+            continue
+        differences = [
+            difference
+            for difference in (
+                _compare_bounds(where, label, line_a[label], line_b[label], atol, rtol)
+                for label in ("x", "y")
+            )
+            if difference is not None
+        ]
+        if not differences and compare_crc and line_a["crc32"] != line_b["crc32"]:
+            differences.append(
+                "{}: values differ, within tolerances of the ranges".format(where)
+            )
+        yield from differences
+
+
+def compare_gout_summaries(
+    summary_a,
+    summary_b,
+    atol=GOUT_ATOL,
+    rtol=GOUT_RTOL,
+    max_differences=GOUT_MAX_DIFFERENCES,
+    compare_crc=True,
+):
+    """
+    Differences between the line summaries of two gout files (see
+    gout_fingerprint), when the files themselves are not available: number of
+    points and ranges of the coordinates, compared as in compare_gout, and the
+    checksums of the values unless `compare_crc` is False (e.g. text and binary
+    gout files, whose values differ by the %g rounding)
+    """
+    differences = []
+    for difference in _iter_summary_differences(
+        summary_a, summary_b, atol, rtol, compare_crc
+    ):
+        if len(differences) == max_differences:
+            differences.append("... more differences suppressed ...")
+            break
+        differences.append(difference)
+    return differences
+
+
+def _compare_values(where, label, a, b, atol, rtol):
+    close = np.isclose(a, b, rtol=rtol, atol=atol, equal_nan=True)
+    if close.all():
+        return None
+    first = int(np.argmin(close))
+    with np.errstate(invalid="ignore"):
+        max_error = float(np.max(np.abs(a - b)))
+    return (
+        "{} {}: {} of {} points differ, max abs error {:g}, "
+        "first divergence at point {}: {:g} vs {:g}".format(
+            where,
+            label,
+            int(close.size - np.count_nonzero(close)),
+            close.size,
+            max_error,
+            first,
+            float(a[first]),
+            float(b[first]),
+        )
+    )
+
+
+def _iter_differences(records_a, records_b, atol, rtol):
+    if len(records_a) != len(records_b):
+        yield "{}/{} calls of verify_graph_()".format(len(records_a), len(records_b))
+    for sim, (graphs_a, graphs_b) in enumerate(zip(records_a, records_b), 1):
+        if len(graphs_a) != len(graphs_b):
+            yield "sim {} has {}/{} graphs".format(sim, len(graphs_a), len(graphs_b))
+            continue
+        for ig, (graph_a, graph_b) in enumerate(zip(graphs_a, graphs_b)):
+            where = "sim {} graph {}".format(sim, ig)
+            if len(graph_a.lines) != len(graph_b.lines):
+                yield "{} has {}/{} lines".format(
+                    where, len(graph_a.lines), len(graph_b.lines)
+                )
+                continue
+            for il, (line_a, line_b) in enumerate(zip(graph_a.lines, graph_b.lines)):
+                where = "sim {} graph {} line {}".format(sim, ig, il)
+                if len(line_a.x) != len(line_b.x):
+                    yield "{} has {}/{} points".format(
+                        where, len(line_a.x), len(line_b.x)
+                    )
+                    continue
+                for label, a, b in (
+                    ("x", line_a.x, line_b.x),
+                    ("y", line_a.y, line_b.y),
+                ):
+                    difference = _compare_values(where, label, a, b, atol, rtol)
+                    if difference is not None:
+                        yield difference
+
+
+def compare_gout(
+    records_a,
+    records_b,
+    atol=GOUT_ATOL,
+    rtol=GOUT_RTOL,
+    max_differences=GOUT_MAX_DIFFERENCES,
+):
+    """
+    Differences between the gout records `records_a` and `records_b` (see
+    read_gout), one line of text each: the coordinates of every line are
+    compared as with numpy.isclose, reporting the number of points that
+    differ, the max abs error and the first divergence. Takes linear time
+    whatever the differences.
+    """
+    differences = []
+    for difference in _iter_differences(records_a, records_b, atol, rtol):
+        if len(differences) == max_differences:
+            differences.append("... more differences suppressed ...")
+            break
+        differences.append(difference)
+    return differences
@@ -1,6 +1,7 @@
 driver_hoc_header = r"""
 strdef verify_dir_ 
 verify_dir_ = "{model_dir}"
+verify_binary_ = {gout_binary}
 """
 
 driver_hoc_body = r"""
@@ -8,11 +9,18 @@ if (name_declared("verify_dir_") == 0) {
 	execute("~strdef verify_dir_")
 	execute("verify_dir_ = \".\"")
 }
+if (name_declared("verify_binary_") == 0) {
+	execute("verify_binary_ = 0")
+}
 strdef verify_tstr_
 objref verify_glist_, verify_xvec_, verify_yvec_, verify_file_
 verify_file_ = new File()
 sprint(verify_tstr_, "%s/gout", verify_dir_)
 verify_file_.wopen(verify_tstr_)
+if (verify_binary_) {
+	// see modeldb/gout.py
+	verify_file_.printf("GOUTB 1\n")
+}
 verify_xvec_ = new Vector()
 verify_yvec_ = new Vector()
 verify_glist_ = new List("Graph")
@@ -29,9 +37,17 @@ proc verify_graph_() {local i, j, k
 		for (j=-1; (j=verify_glist_.object(i).getline(j, verify_xvec_, verify_yvec_)) != -1; ){
 			verify_file_.printf("points %d\n", verify_xvec_.size)
 			verify_file_.printf("xvec%d\n", j)
-			verify_xvec_.printf(verify_file_)
+			if (verify_binary_) {
+				verify_xvec_.vwrite(verify_file_)
+			} else {
+				verify_xvec_.printf(verify_file_)
+			}
 			verify_file_.printf("yvec%d\n", j)
-			verify_yvec_.printf(verify_file_)
+			if (verify_binary_) {
+				verify_yvec_.vwrite(verify_file_)
+			} else {
+				verify_yvec_.printf(verify_file_)
+			}
 		}
 	}
 }
@@ -0,0 +1,165 @@
+"""
+HTTP client of `getmodels`: pooled sessions and per-host rate limiting.
+
+Every host gets a token bucket tuned from the rate limit headers of its
+responses (`X-RateLimit-Remaining`/`X-RateLimit-Reset`, as sent by GitHub), and
+is paused when asked to (`Retry-After`, exhausted quota). Failed requests are
+retried with exponential backoff and full jitter.
+"""
+
+import email.utils
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+# Statuses worth retrying: rate limited, or server side hiccups
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_ATTEMPTS = 5
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_CAP = 60.0  # seconds
+# Requests a host may get at once when its quota allows it
+BURST = 8
+
+# Hosts authenticated with the token of the GITHUB_TOKEN environment variable
+GITHUB_API_HOSTS = ("api.github.com",)
+
+_thread_local = threading.local()
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def http_session():
+    """
+    HTTP session of the current thread: connections to modeldb.science and
+    api.github.com are kept alive and reused across downloads
+    """
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = _thread_local.session = requests.Session()
+    return session
+
+
+def _retry_after(value):
+    """
+    Seconds to wait according to a Retry-After header (delay or HTTP date)
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value).timestamp()
+        return max(retry_at - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter(object):
+    """Token bucket of a host.
+
+    Requests are not limited until the host advertises a quota: the remaining
+    requests are then spread over the time left until the quota resets.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rate = None  # tokens per second, None when unlimited
+        self._capacity = BURST
+        self._tokens = float(BURST)
+        self._stamp = time.monotonic()
+        self._not_before = 0.0
+
+    def acquire(self):
+        """Block until a request to the host is allowed"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._not_before - now
+                if wait <= 0:
+                    if self._rate is None:
+                        return
+                    self._tokens = min(
+                        self._capacity, self._tokens + (now - self._stamp) * self._rate
+                    )
+                    self._stamp = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+    def update(self, headers):
+        """Tune the bucket from the headers of a response of the host"""
+        with self._lock:
+            now = time.monotonic()
+            remaining = headers.get("X-RateLimit-Remaining")
+            reset = headers.get("X-RateLimit-Reset")
+            if remaining is not None and reset is not None:
+                remaining = int(remaining)
+                window = max(float(reset) - time.time(), 1.0)
+                if remaining == 0:
+                    # quota exhausted: pause until it resets
+                    self._not_before = max(self._not_before, now + window)
+                    self._rate = None
+                else:
+                    self._rate = remaining / window
+                    self._capacity = max(1.0, min(float(remaining), BURST))
+                    self._tokens = min(self._tokens, self._capacity)
+                    self._stamp = now
+            retry_after = _retry_after(headers.get("Retry-After"))
+            if retry_after is not None:
+                self._not_before = max(self._not_before, now + retry_after)
+
+
+def host_limiter(host):
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = HostLimiter()
+        return _limiters[host]
+
+
+def backoff_delay(attempt):
+    """
+    Exponential backoff with full jitter for the `attempt`-th retry (0 based)
+    """
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+
+def http_get(url, num_attempts=RETRY_ATTEMPTS, headers=None, **kwargs):
+    """
+    GET `url` through the limiter of its host, retrying rate limited and failed
+    requests. Returns the last response (whatever its status).
+    """
+    host = urlparse(url).hostname
+    limiter = host_limiter(host)
+    headers = dict(headers or {})
+    if host in GITHUB_API_HOSTS and os.environ.get("GITHUB_TOKEN"):
+        headers.setdefault("Authorization", "Bearer " + os.environ["GITHUB_TOKEN"])
+    for attempt in range(num_attempts):
+        last_attempt = attempt == num_attempts - 1
+        limiter.acquire()
+        try:
+            response = http_session().get(url, headers=headers, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if last_attempt:
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        limiter.update(response.headers)
+        rate_limited = (
+            response.status_code == requests.codes.forbidden
+            and response.headers.get("X-RateLimit-Remaining") == "0"
+        )
+        if last_attempt or not (
+            rate_limited or response.status_code in RETRY_STATUSES
+        ):
+            return response
+        response.close()
+        # the limiter holds requests back until Retry-After or the quota reset
+        time.sleep(backoff_delay(attempt))
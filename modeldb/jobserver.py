@@ -0,0 +1,157 @@
+"""GNU make jobserver shared by all model runs and nrnivmodl builds"""
+
+import asyncio
+import contextlib
+import os
+import shutil
+import tempfile
+
+# Jobs of the `make -j 4` hardcoded in nrnivmodl
+NRNIVMODL_JOBS = 4
+
+# nrnivmodl hardcodes `make -j 4`. With an explicit -j, make ignores the
+# jobserver it inherits and starts its own, so we put this wrapper first in
+# PATH: it drops -j from the arguments and joins our jobserver instead.
+make_wrapper_sh = r"""#!/bin/sh
+skip_jobs=
+for arg do
+    shift
+    if [ -n "$skip_jobs" ]; then
+        skip_jobs=
+        case "$arg" in
+            [0-9]*) continue ;;
+        esac
+    fi
+    case "$arg" in
+        -j|--jobs) skip_jobs=1; continue ;;
+        -j[0-9]*|--jobs=*) continue ;;
+    esac
+    set -- "$@" "$arg"
+done
+exec 3<>"$MODELDB_JOBSERVER_FIFO"
+MAKEFLAGS="-j --jobserver-fds=3,3 $MAKEFLAGS" exec "$MODELDB_MAKE" "$@"
+"""
+
+
+class JobServer(object):
+    """Token based core budget, in the form of a GNU make jobserver.
+
+    The tokens live in a named pipe, so that pool workers (whatever the
+    multiprocessing start method) can all draw from it. Every model run holds
+    one token, which doubles as the implicit token of its make. The make of a
+    build gets its own pipe, holding the tokens that are idle when the build
+    starts: they are given back by the model run once the build is over, so a
+    make killed while holding tokens (timeout, Ctrl-C) does not shrink the
+    budget of the rest of the run.
+    """
+
+    def __init__(self, slots):
+        self._slots = slots
+        self._make = shutil.which("make")
+        self._dir = tempfile.mkdtemp(prefix="modeldb-jobserver-")
+        self._fifo = os.path.join(self._dir, "fifo")
+        os.mkfifo(self._fifo)
+        # the pipe buffer is dropped once nobody has the fifo open anymore
+        self._fd = os.open(self._fifo, os.O_RDWR)
+        os.write(self._fd, b"+" * slots)
+        # non-blocking end of the fifo shared by the acquire_async waiters
+        self._async_fd = None
+        self._async_lock = None
+
+        self._wrapper_dir = os.path.join(self._dir, "bin")
+        os.mkdir(self._wrapper_dir)
+        wrapper = os.path.join(self._wrapper_dir, "make")
+        with open(wrapper, "w") as make_wrapper:
+            make_wrapper.write(make_wrapper_sh)
+        os.chmod(wrapper, 0o755)
+
+    slots = property(lambda self: self._slots)
+
+    def __getstate__(self):
+        # the owner's file descriptor is meaningless in pool workers
+        state = self.__dict__.copy()
+        state["_fd"] = None
+        state["_async_fd"] = None
+        state["_async_lock"] = None
+        return state
+
+    def acquire(self):
+        """Block until a token is available and return it"""
+        fd = os.open(self._fifo, os.O_RDWR)
+        try:
+            return os.read(fd, 1)
+        finally:
+            os.close(fd)
+
+    async def acquire_async(self):
+        """Wait for a token without blocking the event loop and return it"""
+        loop = asyncio.get_running_loop()
+        if self._async_fd is None:
+            self._async_fd = os.open(self._fifo, os.O_RDWR | os.O_NONBLOCK)
+            self._async_lock = asyncio.Lock()
+        fd = self._async_fd
+        # a file descriptor has a single reader callback: waiters take turns
+        async with self._async_lock:
+            while True:
+                try:
+                    return os.read(fd, 1)
+                except BlockingIOError:
+                    readable = loop.create_future()
+                    loop.add_reader(
+                        fd, lambda: readable.done() or readable.set_result(None)
+                    )
+                    try:
+                        await readable
+                    finally:
+                        loop.remove_reader(fd)
+
+    def try_acquire(self, count):
+        """Take up to `count` tokens without blocking and return them"""
+        fd = os.open(self._fifo, os.O_RDWR | os.O_NONBLOCK)
+        try:
+            return os.read(fd, count)
+        except BlockingIOError:
+            return b""
+        finally:
+            os.close(fd)
+
+    def release(self, token):
+        fd = os.open(self._fifo, os.O_RDWR)
+        try:
+            os.write(fd, token)
+        finally:
+            os.close(fd)
+
+    @contextlib.contextmanager
+    def build(self, jobs=NRNIVMODL_JOBS):
+        """
+        Environment of an nrnivmodl build whose make runs up to `jobs` jobs, on
+        the cores idle when the build starts
+        """
+        tokens = self.try_acquire(jobs - 1)
+        build_dir = tempfile.mkdtemp(dir=self._dir)
+        fifo = os.path.join(build_dir, "fifo")
+        os.mkfifo(fifo)
+        fd = os.open(fifo, os.O_RDWR)
+        try:
+            os.write(fd, tokens)
+            yield {
+                "PATH": self._wrapper_dir + os.pathsep + os.environ.get("PATH", ""),
+                "MODELDB_MAKE": self._make,
+                "MODELDB_JOBSERVER_FIFO": fifo,
+            }
+        finally:
+            # whatever make gave back (or not) to its pipe
+            os.close(fd)
+            shutil.rmtree(build_dir, ignore_errors=True)
+            if tokens:
+                self.release(tokens)
+
+    def close(self):
+        if self._async_fd is not None:
+            os.close(self._async_fd)
+            self._async_fd = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        shutil.rmtree(self._dir, ignore_errors=True)
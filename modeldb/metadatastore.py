@@ -0,0 +1,120 @@
+"""
+SQLite store of the metadata of the downloaded models.
+
+It replaces the YAML-pickled MODELDB_METADATA_FILE: models are looked up by id
+and updated one by one, without loading or rewriting the whole catalogue.
+The YAML file, when present, is imported automatically (again whenever it
+changes, only adding the models missing from the store).
+"""
+
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+import yaml
+
+from .config import *
+from .data import Model
+
+_schema = """
+CREATE TABLE IF NOT EXISTS models (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    created TEXT,
+    ver_date TEXT,
+    sha256 TEXT
+);
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class MetadataStore(MutableMapping):
+    """Mapping of model id to Model, backed by SQLite"""
+
+    def __init__(self, path=MODELDB_METADATA_DB, yaml_file=MODELDB_METADATA_FILE):
+        self._path = path
+        self._yaml_file = yaml_file
+        # one connection per thread (and process)
+        self._local = threading.local()
+        self._migrate_yaml()
+
+    @property
+    def _connection(self):
+        # connections must not be shared with forked processes, nor with other
+        # threads (e.g. the task feeder of a multiprocessing.Pool)
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.db = sqlite3.connect(self._path)
+            local.db.executescript(_schema)
+            local.pid = os.getpid()
+        return local.db
+
+    exists = property(
+        lambda self: os.path.isfile(self._path) or os.path.isfile(self._yaml_file)
+    )
+
+    def _migrate_yaml(self):
+        if not os.path.isfile(self._yaml_file):
+            return
+        yaml_mtime = str(os.stat(self._yaml_file).st_mtime_ns)
+        row = self._connection.execute(
+            "SELECT value FROM info WHERE key = 'yaml_mtime'"
+        ).fetchone()
+        if row is not None and row[0] == yaml_mtime:
+            return
+        with open(self._yaml_file) as meta_file:
+            metadata = yaml.load(meta_file, yaml.Loader) or {}
+        with self._connection as db:
+            # rows updated since (e.g. by getmodels) are more recent than the YAML
+            db.executemany(
+                "INSERT OR IGNORE INTO models VALUES (?, ?, ?, ?, ?)",
+                [self._row(model_id, model) for model_id, model in metadata.items()],
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO info VALUES ('yaml_mtime', ?)", (yaml_mtime,)
+            )
+
+    @staticmethod
+    def _row(model_id, model):
+        return (model_id, model.name, model.created, model.last_modified, model.sha256)
+
+    def __getitem__(self, model_id):
+        row = self._connection.execute(
+            "SELECT id, name, created, ver_date, sha256 FROM models WHERE id = ?",
+            (model_id,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(model_id)
+        return Model(*row)
+
+    def __setitem__(self, model_id, model):
+        with self._connection as db:
+            db.execute(
+                "INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?, ?)",
+                self._row(model_id, model),
+            )
+
+    def __delitem__(self, model_id):
+        with self._connection as db:
+            deleted = db.execute("DELETE FROM models WHERE id = ?", (model_id,))
+            if deleted.rowcount == 0:
+                raise KeyError(model_id)
+
+    def __contains__(self, model_id):
+        return (
+            self._connection.execute(
+                "SELECT 1 FROM models WHERE id = ?", (model_id,)
+            ).fetchone()
+            is not None
+        )
+
+    def __iter__(self):
+        rows = self._connection.execute("SELECT id FROM models ORDER BY id")
+        return iter([row[0] for row in rows.fetchall()])
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM models").fetchone()[0]
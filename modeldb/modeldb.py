@@ -1,33 +1,148 @@
+import json
 import logging
-import multiprocessing
 import os
+import threading
 import time
+import zipfile
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pformat
 
 import requests
 import yaml
 
 from .config import *
+from .data import file_sha256
 from .data import Model
+from .httpclient import *
+from .metadatastore import MetadataStore
 from .progressbar import ProgressBar
+from .runinstr import load_run_instructions
+
+
+# Number of concurrent downloads of `getmodels`
+DOWNLOAD_JOBS = 8
+
+
+def download_zip(url, model_zip_uri, num_attempts=3):
+    """
+    Download the zip at `url` into `model_zip_uri` and return its sha256.
+
+    The zip is streamed to `<model_zip_uri>.part`, which is resumed with an
+    HTTP Range request if a previous attempt (or run) was interrupted. It only
+    replaces `model_zip_uri` once all its members passed their CRC check, so
+    the cache never holds a truncated zip.
+    """
+    part_uri = model_zip_uri + ".part"
+    errors = []
+    for attempt in range(num_attempts):
+        offset = os.path.getsize(part_uri) if os.path.isfile(part_uri) else 0
+        headers = {"Range": "bytes={}-".format(offset)} if offset else {}
+        try:
+            with http_get(url, headers=headers, stream=True) as response:
+                if response.status_code == requests.codes.range_not_satisfiable:
+                    # nothing left to fetch, or a stale part: start over
+                    os.remove(part_uri)
+                    errors.append(response.status_code)
+                    continue
+                if response.status_code not in (
+                    requests.codes.ok,
+                    requests.codes.partial_content,
+                ):
+                    errors.append(response.status_code)
+                    continue
+                # servers ignoring Range answer 200 with the whole zip
+                resumed = response.status_code == requests.codes.partial_content
+                with open(part_uri, "ab" if resumed else "wb") as part:
+                    for chunk in response.iter_content(chunk_size=1 << 16):
+                        part.write(chunk)
+        except requests.RequestException as e:
+            # keep what was received, the next attempt resumes from there
+            errors.append(repr(e))
+            time.sleep(backoff_delay(attempt))
+            continue
+        try:
+            with zipfile.ZipFile(part_uri) as zip_ref:
+                bad_member = zip_ref.testzip()
+        except zipfile.BadZipFile as e:
+            bad_member = str(e)
+        if bad_member is not None:
+            # e.g. a part left over from an older version of the model
+            os.remove(part_uri)
+            errors.append("corrupt zip: {}".format(bad_member))
+            continue
+        sha256 = file_sha256(part_uri)
+        os.replace(part_uri, model_zip_uri)
+        return sha256
+    raise Exception("Failed to download {} with errors {}".format(url, errors))
+
+
+def load_sync_state():
+    """
+    State of the last catalogue sync: time, and per catalogue query the
+    validators (ETag, Last-Modified) and data of the last response
+    """
+    if not os.path.isfile(MODELDB_SYNC_STATE_FILE):
+        return {"queries": {}}
+    with open(MODELDB_SYNC_STATE_FILE) as sync_file:
+        return json.load(sync_file)
+
+
+def save_sync_state(sync_state):
+    tmp_file = MODELDB_SYNC_STATE_FILE + ".tmp"
+    with open(tmp_file, "w") as sync_file:
+        json.dump(sync_state, sync_file, indent=4, sort_keys=True)
+    os.replace(tmp_file, MODELDB_SYNC_STATE_FILE)
+
+
+def conditional_get_json(url, sync_state):
+    """
+    GET the json at `url`, revalidating the response stored in `sync_state`
+    (If-None-Match/If-Modified-Since) rather than fetching it again
+    """
+    cached = sync_state["queries"].get(url)
+    headers = {}
+    if cached is not None:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    response = http_get(url, headers=headers)
+    if cached is not None and response.status_code == requests.codes.not_modified:
+        return cached["data"]
+    response.raise_for_status()
+    data = response.json()
+    sync_state["queries"][url] = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "data": data,
+    }
+    return data
 
 
 def download_model(arg_tuple):
-    model_id, model_run_info, expected_ver_date = arg_tuple
+    model_id, model_run_info, expected_ver_date, known_model = arg_tuple
     try:
-        # Fetch the model metadata from ModelDB.
-        model_json = requests.get(
-            MDB_MODEL_METADATA_URL.format(model_id=model_id)
-        ).json()
-        # Check that the timestamp matches our expectations.
-        assert model_json["ver_date"] == expected_ver_date
-        # Assemble a Model object from the JSON metadata just fetched
-        model = Model(
-            model_json["id"],
-            model_json["name"],
-            model_json["created"],
-            model_json["ver_date"],
-        )
+        if known_model is not None:
+            # the catalogue already told us the new ver_date, the rest of the
+            # metadata does not change between versions
+            model = Model(
+                model_id, known_model.name, known_model.created, expected_ver_date
+            )
+        else:
+            # Fetch the model metadata from ModelDB.
+            model_json = http_get(
+                MDB_MODEL_METADATA_URL.format(model_id=model_id)
+            ).json()
+            # Check that the timestamp matches our expectations.
+            assert model_json["ver_date"] == expected_ver_date
+            # Assemble a Model object from the JSON metadata just fetched
+            model = Model(
+                model_json["id"],
+                model_json["name"],
+                model_json["created"],
+                model_json["ver_date"],
+            )
         # Now fetch the actual model data .zip file. By default this also comes
         # from ModelDB, but it can be overriden to come from GitHub instead.
         if "github" in model_run_info:
@@ -74,20 +189,7 @@ def download_model(arg_tuple):
         )
 
         # Download the model data from `url`. Retry a few times on failure.
-        num_attempts = 3
-        status_codes = []
-        for _ in range(num_attempts):
-            model_download_response = requests.get(url)
-            status_codes.append(model_download_response.status_code)
-            if model_download_response.status_code == requests.codes.ok:
-                break
-            time.sleep(5)
-        else:
-            raise Exception(
-                "Failed to download {} with status codes {}".format(url, status_codes)
-            )
-        with open(model_zip_uri, "wb+") as zipfile:
-            zipfile.write(model_download_response.content)
+        model.sha256 = download_zip(url, model_zip_uri)
     except Exception as e:  #  noqa
         model = e
 
@@ -107,8 +209,6 @@ class ModelDB(object):
         self._setup_logging()
         try:
             self._load_metadata()
-        except FileNotFoundError:
-            ModelDB.logger.warning("{} not found!".format(MODELDB_METADATA_FILE))
         except yaml.YAMLError as y:
             ModelDB.logger.error(
                 "Error loading {}: {}".format(MODELDB_METADATA_FILE, y)
@@ -117,16 +217,25 @@ class ModelDB(object):
         except Exception as e:
             raise e
 
-    def download_models(self, model_list=None):
+    def download_models(self, model_list=None, jobs=DOWNLOAD_JOBS):
         if not os.path.isdir(MODELS_ZIP_DIR):
             ModelDB.logger.info("Creating cache directory: {}".format(MODELS_ZIP_DIR))
             os.mkdir(MODELS_ZIP_DIR)
 
         # Fetch the list of NEURON model IDs, and a list of timestamps for
         # those models. We do this even if `model_list` is not None to build
-        # the model ID -> timestamp mapping.
+        # the model ID -> timestamp mapping. Both lists are revalidated
+        # against the ones of the last sync.
+        sync_state = load_sync_state()
+        if "last_sync" in sync_state:
+            ModelDB.logger.info(
+                "Last sync: {}".format(time.ctime(sync_state["last_sync"]))
+            )
+
         def query(field):
-            return requests.get(MDB_NEURON_MODELS_URL.format(model_field=field)).json()
+            return conditional_get_json(
+                MDB_NEURON_MODELS_URL.format(model_field=field), sync_state
+            )
 
         all_model_ids = query("id")
         all_model_timestamps = query("ver_date")
@@ -166,37 +275,44 @@ class ModelDB(object):
             else:
                 ModelDB.logger.debug("Model {} not found in cache".format(model_id))
             models_to_download.append(
-                (model_id, self._run_instr.get(model_id, {}), new_ver_date)
+                (
+                    model_id,
+                    self._run_instr.get(model_id, {}),
+                    new_ver_date,
+                    self._metadata.get(model_id),
+                )
             )
-        # Download the missing or out of date models in parallel
-        pool = multiprocessing.Pool(8)
-        processed_models = pool.imap_unordered(download_model, models_to_download)
+        # Download the missing or out of date models in parallel: the work is
+        # I/O bound, threads with a pooled session each are enough
         download_err = {}
-        for model_id, model in ProgressBar.iter(
-            processed_models, len(models_to_download)
-        ):
-            if not isinstance(model, Exception):
-                self._metadata[model_id] = model
-            else:
-                download_err[model_id] = model
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            processed_models = as_completed(
+                [executor.submit(download_model, item) for item in models_to_download]
+            )
+            for processed_model in ProgressBar.iter(
+                processed_models, len(models_to_download)
+            ):
+                model_id, model = processed_model.result()
+                if not isinstance(model, Exception):
+                    self._metadata[model_id] = model
+                else:
+                    download_err[model_id] = model
 
         if download_err:
             ModelDB.logger.error("Error downloading models:")
             ModelDB.logger.error(pformat(download_err))
 
-        self._save_metadata()
+        sync_state["last_sync"] = time.time()
+        save_sync_state(sync_state)
 
     def _load_metadata(self):
-        with open(MODELDB_METADATA_FILE) as meta_file:
-            self._metadata = yaml.load(meta_file, yaml.Loader)
+        # models are read and written one by one, on demand
+        self._metadata = MetadataStore()
+        if not self._metadata.exists:
+            ModelDB.logger.warning("{} not found!".format(MODELDB_METADATA_DB))
 
     def _load_run_instructions(self):
-        with open(MODELDB_RUN_FILE) as run_file:
-            self._run_instr = yaml.load(run_file, yaml.Loader)
-
-    def _save_metadata(self):
-        with open(MODELDB_METADATA_FILE, "w+") as meta_file:
-            yaml.dump(self._metadata, meta_file, sort_keys=True)
+        self._run_instr = load_run_instructions()
 
     def _setup_logging(self):
         if ModelDB.logger is not None:
@@ -214,3 +330,19 @@ class ModelDB(object):
         ModelDB.logger.setLevel(logging.DEBUG)
         ModelDB.logger.addHandler(consoleHandler)
         ModelDB.logger.addHandler(fileHandler)
+
+
+_shared_modeldb = None
+_shared_modeldb_lock = threading.Lock()
+
+
+def shared_modeldb():
+    """
+    The ModelDB of the process, loaded on first use: commands that do not
+    need the run instructions or the metadata do not pay for them
+    """
+    global _shared_modeldb
+    with _shared_modeldb_lock:
+        if _shared_modeldb is None:
+            _shared_modeldb = ModelDB()
+        return _shared_modeldb
@@ -1,11 +1,18 @@
+import asyncio
+import contextlib
+import functools
 import glob
 import json
+import locale
 import logging
 import multiprocessing
 import platform
+import resource
 import shutil
+import signal
 import subprocess
 import sys
+import threading
 import time
 import traceback
 import zipfile
@@ -15,12 +22,43 @@ from typing import Union
 
 import yaml
 
-from . import modeldb
+from .modeldb import shared_modeldb
+from .buildcache import harvest_mod_objects
+from .buildcache import mod_file_key
+from .buildcache import mod_group_key
+from .buildcache import restore_build
+from .buildcache import seed_mod_objects
+from .buildcache import store_build
+from .buildcache import toolchain_fingerprint
 from .config import *
+from .curation import curator
+from .extractcache import extract_model
+from .extractcache import zip_key
+from .gout import gout_fingerprint
+from .gout import gout_text_lines
+from .gout import GoutFormatError
 from .hocscripts import *
+from .jobserver import JobServer
 from .progressbar import ProgressBar
-
-ModelDB = modeldb.ModelDB()
+from .resultcache import rebase_paths
+from .resultcache import restore_result
+from .resultcache import result_key
+from .resultcache import store_result
+from .runlog import RunLog
+from .schedule import expected_runtimes
+from .schedule import load_runtime_history
+from .schedule import longest_first
+from .schedule import predict_wall_time
+from .schedule import shard
+from .schedule import update_runtime_history
+from .scratch import holds_model_files
+from .scratch import persist_artifacts
+from .scratch import rehydrate
+from .zipmanifest import manifest_mod_groups
+from .zipmanifest import manifest_mosinit
+from .zipmanifest import zip_manifest
+
+NRN_RUN_LOG_FILE = "nrn_run.log"
 
 
 def find_modfile_group(dirs: Sequence[Union[str, Path]], /) -> list[Path]:
@@ -51,14 +89,42 @@ def is_dir_non_empty(directory):
 
 
 class ModelRun(dict):
-    def __init__(self, model, working_dir, clean=False, norun=False, inplace=False):
+    def __init__(
+        self,
+        model,
+        working_dir,
+        clean=False,
+        norun=False,
+        inplace=False,
+        build_cache=None,
+        object_cache=None,
+        jobserver=None,
+        timeout=None,
+        max_memory=None,
+        extract_cache=False,
+        scratch_dir=None,
+        scratch_keep_build=False,
+        gout_format="text",
+        report_gout=False,
+    ):
         super().__init__()
         self._model = model
         self._working_dir = os.path.abspath(working_dir)
+        # models run in <scratch_dir>/<model id> when given, their artifacts
+        # are then persisted to <working_dir>/<model id>
+        self._scratch_dir = os.path.abspath(scratch_dir) if scratch_dir else None
+        self._scratch_keep_build = scratch_keep_build
         self._logs = []
         self._gout = []
-        self._nrn_run = []
+        # "text" or "binary" (see gout.py); the gout is only read back when
+        # it is included in the report
+        self._gout_format = gout_format
+        self._report_gout = report_gout
+        # NEURON output, streamed to <model root dir>/nrn_run.log
+        self._nrn_run = RunLog(os.path.join(self.root_dir, NRN_RUN_LOG_FILE))
         self._nrn_run_error = False
+        # hashes of the curated NEURON output and of the gout (see gout.py)
+        self._fingerprint = {}
         self._no_mosinit_hoc = False
         self._run_time = 0
         self._run_times = {}
@@ -66,6 +132,21 @@ class ModelRun(dict):
         self._clean = clean
         self._norun = norun
         self._inplace = inplace
+        # toolchain fingerprints when the compiled mechanism caches are enabled
+        self._build_cache = build_cache
+        self._build_cache_stats = {"hits": [], "misses": []}
+        self._object_cache = object_cache
+        self._object_cache_stats = {"hits": 0, "misses": 0}
+        self._extract_cache = extract_cache
+        self._extract_cache_hit = False
+        # content of the model zip, when it describes the model directory
+        self._manifest = None
+        self._jobserver = jobserver
+        # default limits, `timeout`/`max_memory` in modeldb-run.yaml override them
+        self._timeout = timeout
+        self._max_memory = max_memory
+        self._deadline = None
+        self._timed_out = False
 
         self["run_info"] = {}
 
@@ -73,8 +154,8 @@ class ModelRun(dict):
 
     def _fetch_model(self):
         # get run instruction from ModelDB
-        if self.id in ModelDB.run_instr:
-            self.update(ModelDB.run_instr[self.id])
+        if self.id in shared_modeldb().run_instr:
+            self.update(shared_modeldb().run_instr[self.id])
 
         # check if model is run in Python
         if "python" in self:
@@ -96,17 +177,37 @@ class ModelRun(dict):
 
     logs = property(lambda self: self._logs)
     gout = property(lambda self: self._gout)
+    gout_format = property(lambda self: self._gout_format)
     nrn_run = property(lambda self: self._nrn_run)
     no_mosinit_hoc = property(lambda self: self._no_mosinit_hoc)
     run_py = property(lambda self: self._run_py)
 
     nrn_run_error = property(lambda self: self._nrn_run_error)
+    fingerprint = property(lambda self: self._fingerprint)
     model_dir = property(
         lambda self: self.run_info["model_dir"] if "model_dir" in self.run_info else ""
     )
     working_dir = property(lambda self: self._working_dir)
     run_time = property(lambda self: self._run_time)
     run_times = property(lambda self: self._run_times)
+    build_cache = property(lambda self: self._build_cache)
+    build_cache_stats = property(lambda self: self._build_cache_stats)
+    object_cache = property(lambda self: self._object_cache)
+    object_cache_stats = property(lambda self: self._object_cache_stats)
+    extract_cache = property(lambda self: self._extract_cache)
+    extract_cache_hit = property(lambda self: self._extract_cache_hit)
+    manifest = property(lambda self: self._manifest)
+    scratch_dir = property(lambda self: self._scratch_dir)
+    # where the model is extracted, compiled and run
+    root_dir = property(
+        lambda self: os.path.join(self._scratch_dir or self._working_dir, str(self.id))
+    )
+    working_root = property(lambda self: os.path.join(self._working_dir, str(self.id)))
+    jobserver = property(lambda self: self._jobserver)
+    timeout = property(lambda self: self.get("timeout", self._timeout))
+    max_memory = property(lambda self: self.get("max_memory", self._max_memory))
+    deadline = property(lambda self: self._deadline)
+    timed_out = property(lambda self: self._timed_out)
 
     id = property(lambda self: self._model.id)
 
@@ -123,35 +224,246 @@ def append_log(model, model_sink, text):
     model_sink.extend(curate_log_string(model, text).split("\n"))
 
 
+def _set_memory_limit(max_memory):
+    limit = int(max_memory) * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def popen_with_limits(model, cmds, **kwargs):
+    """
+    Start `cmds` in a new process group, limited to the `max_memory` (MB) of `model`
+    """
+    return subprocess.Popen(
+        cmds,
+        start_new_session=True,
+        preexec_fn=functools.partial(_set_memory_limit, model.max_memory)
+        if model.max_memory
+        else None,
+        **kwargs,
+    )
+
+
+def _kill_process_group(sp):
+    with contextlib.suppress(ProcessLookupError):
+        os.killpg(sp.pid, signal.SIGKILL)
+
+
+def _kill_timed_out(model, sp):
+    if sp.poll() is None:
+        model._timed_out = True
+        _kill_process_group(sp)
+
+
+@contextlib.contextmanager
+def deadline_watchdog(model, sp):
+    """
+    Kill the process group of `sp` once `model` runs out of time
+    """
+    watchdog = None
+    if model.deadline is not None:
+        watchdog = threading.Timer(
+            max(model.deadline - time.perf_counter(), 0),
+            _kill_timed_out,
+            (model, sp),
+        )
+        watchdog.daemon = True
+        watchdog.start()
+    try:
+        yield
+    except BaseException:
+        # e.g. KeyboardInterrupt: the process group does not get it from the terminal
+        _kill_process_group(sp)
+        raise
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+            watchdog.join()
+
+
+def communicate_with_limits(model, sp):
+    """
+    Collect the output of `sp`; kill its process group once `model` runs out of time
+    """
+    with deadline_watchdog(model, sp):
+        return sp.communicate()
+
+
+def _decode_text(out):
+    # same as `universal_newlines=True`
+    return (
+        out.decode(locale.getpreferredencoding(False))
+        .replace("\r\n", "\n")
+        .replace("\r", "\n")
+    )
+
+
+class Command(object):
+    """A subprocess of a model run, executed by the driver of the run.
+
+    Its output is handed line by line to `sink` when given; otherwise the
+    whole output is collected and returned as text.
+    """
+
+    def __init__(self, cmds, env=None, cwd=None, sink=None):
+        self.cmds = cmds
+        self.env = env
+        self.cwd = cwd
+        self.sink = sink
+
+
+def execute(model, command):
+    """
+    Run `command` for `model`, returning its exit code and (collected) output
+    """
+    sp = popen_with_limits(
+        model,
+        command.cmds,
+        env=command.env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        cwd=command.cwd,
+    )
+    if command.sink is None:
+        out, _ = communicate_with_limits(model, sp)
+        return sp.returncode, _decode_text(out)
+    with deadline_watchdog(model, sp), sp.stdout:
+        for line in sp.stdout:
+            command.sink(line)
+        sp.wait()
+    return sp.returncode, None
+
+
+def run_steps(model, steps):
+    """
+    Drive the generator `steps` of a model run: execute the commands it yields
+    and send back their results (or throw their exceptions)
+    """
+    result = error = None
+    while True:
+        try:
+            command = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            result, error = execute(model, command), None
+        except Exception as e:  # noqa
+            result, error = None, e
+
+
+def _kill_timed_out_async(model, sp):
+    if sp.returncode is None:
+        model._timed_out = True
+        _kill_process_group(sp)
+
+
+async def _read_output(stream, sink):
+    chunks = []
+    pending = b""
+    while True:
+        chunk = await stream.read(1 << 16)
+        if not chunk:
+            break
+        if sink is None:
+            chunks.append(chunk)
+            continue
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            sink(line + b"\n")
+    if pending:
+        sink(pending)
+    return b"".join(chunks)
+
+
+async def execute_async(model, command):
+    """
+    Like `execute`, as an asyncio subprocess
+    """
+    sp = await asyncio.create_subprocess_exec(
+        *command.cmds,
+        env=command.env,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        cwd=command.cwd,
+        start_new_session=True,
+        preexec_fn=functools.partial(_set_memory_limit, model.max_memory)
+        if model.max_memory
+        else None,
+    )
+    watchdog = None
+    if model.deadline is not None:
+        watchdog = asyncio.get_running_loop().call_later(
+            max(model.deadline - time.perf_counter(), 0),
+            _kill_timed_out_async,
+            model,
+            sp,
+        )
+    try:
+        out = await _read_output(sp.stdout, command.sink)
+        await sp.wait()
+    except BaseException:
+        # e.g. cancellation on Ctrl-C
+        _kill_process_group(sp)
+        await sp.wait()
+        raise
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+    return sp.returncode, None if command.sink is not None else _decode_text(out)
+
+
+async def run_steps_async(model, steps):
+    """
+    Like `run_steps`, executing the commands as asyncio subprocesses
+    """
+    result = error = None
+    while True:
+        try:
+            command = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            result, error = await execute_async(model, command), None
+        except Exception as e:  # noqa
+            result, error = None, e
+
+
 def run_commands(model, cmds, env={}, work_dir=None):
-    full_env = os.environ
+    full_env = dict(os.environ)
     full_env.update(env)
-    out, _ = subprocess.Popen(
+    returncode, out = yield Command(
         cmds,
         env=full_env,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True,
         cwd=model.model_dir if work_dir is None else work_dir,
-    ).communicate()
+    )
 
     model.logs.extend(curate_log_string(model, out).split("\n"))
+    if model.timed_out:
+        raise TimeoutError(
+            "{} killed after the {} s timeout".format(" ".join(cmds), model.timeout)
+        )
+    return returncode
 
 
 def run_neuron_cmds(model, cmds):
-    sp = subprocess.Popen(
-        cmds,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        cwd=model.run_info["start_dir"],
-    )
-    out, _ = sp.communicate()
-    try:
-        out = out.decode("utf-8")
-    except UnicodeDecodeError:
-        raise Exception("Could not decode output:" + repr(out))
-    model.nrn_run.extend(curate_log_string(model, out).splitlines())
-    if sp.returncode != 0 and not model.get("ignore_exit_code", False):
+    def _stream_line(line):
+        try:
+            line = line.decode("utf-8")
+        except UnicodeDecodeError:
+            raise Exception("Could not decode output:" + repr(line))
+        model.nrn_run.extend(curate_log_string(model, line).splitlines())
+
+    # stream the output to the run log as it is produced
+    with model.nrn_run.streaming():
+        returncode, _ = yield Command(
+            cmds, cwd=model.run_info["start_dir"], sink=_stream_line
+        )
+    if model.timed_out:
+        append_log(
+            model,
+            model.nrn_run,
+            "Model killed after the {} s timeout".format(model.timeout),
+        )
+    elif returncode != 0 and not model.get("ignore_exit_code", False):
         model._nrn_run_error = True
 
 
@@ -159,7 +471,7 @@ def clean_model_dir(model):
     """
     Delete the x86_64 folder
     """
-    run_commands(
+    yield from run_commands(
         model,
         ["/bin/sh", "-c", "rm -rf ./{}/".format(platform.machine())],
         work_dir=model.run_info["start_dir"],
@@ -172,27 +484,61 @@ def compile_mods(model, mods: list[list[Path]]):
     """
     # Unfortunately nrnivmodl doesn't have an option to steer how much build
     # parallellism it tries to do, it just hardcodes `make -j 4`. Because we
-    # parallelise over models, at a higher level, we want to remove this
-    # internal parallelism from nrnivmodl. In the CI we install NEURON using
-    # pip from precompiled wheels, and the real nrnivmodl is hidden behind
-    # an extra layer of wrappers. This makes it inconvenient to change the
-    # hardcoded value. Instead, we try to achieve the same effect using Make's
-    # environment variables. --max-load 0.0 should ban >1 job being launched if
-    # the system load is larger than zero.
+    # parallelise over models, at a higher level, we want nrnivmodl to only use
+    # the cores that are left idle by the other model runs. When the run is
+    # driven by a ModelRunManager, every make joins its jobserver (see
+    # jobserver.py). Otherwise we try to remove the internal parallelism using
+    # Make's environment variables: --max-load 0.0 should ban >1 job being
+    # launched if the system load is larger than zero.
+    def make_env():
+        if model.jobserver is not None:
+            return model.jobserver.build()
+        return contextlib.nullcontext({"MAKEFLAGS": " --max-load 0.0"})
+
+    start_dir = model.run_info["start_dir"]
     for mod in mods:
-        run_commands(
-            model,
-            ["nrnivmodl"] + [str(item) for item in mod],
-            env={"MAKEFLAGS": " --max-load 0.0"},
-            work_dir=model.run_info["start_dir"],
-        )
+        # every group starts from an empty build folder: nothing is left over
+        # from reruns or from the previous group
+        yield from clean_model_dir(model)
+        if model.build_cache is not None:
+            key = mod_group_key(mod, start_dir, model.build_cache)
+            cached_logs = restore_build(key, start_dir)
+            if cached_logs is not None:
+                model.logs.extend(cached_logs)
+                model.build_cache_stats["hits"].append(key)
+                continue
+            model.build_cache_stats["misses"].append(key)
+        if model.object_cache is not None:
+            build_dir = os.path.join(start_dir, platform.machine())
+            mod_keys = {item: mod_file_key(item, model.object_cache) for item in mod}
+            seeded = seed_mod_objects(mod_keys, build_dir)
+        nof_logs = len(model.logs)
+        with make_env() as env:
+            returncode = yield from run_commands(
+                model,
+                ["nrnivmodl"] + [str(item) for item in mod],
+                env=env,
+                work_dir=start_dir,
+            )
+        if model.object_cache is not None:
+            hits, misses = harvest_mod_objects(mod_keys, build_dir, seeded)
+            model.object_cache_stats["hits"] += hits
+            model.object_cache_stats["misses"] += misses
+        # failed builds may still hold the `special` of an earlier build
+        if model.build_cache is not None and returncode == 0:
+            store_build(key, start_dir, model.logs[nof_logs:])
 
 
 def build_driver_hoc(model):
     model.run_info["driver"] = os.path.join(model.model_dir, "driver.hoc")
 
     with open(model.run_info["driver"], "w") as drv:
-        drv.write(driver_hoc_header.format(model_dir=model.model_dir))
+        drv.write(
+            driver_hoc_header.format(
+                model_dir=model.model_dir,
+                gout_binary=int(model.gout_format == "binary"),
+            )
+        )
         drv.writelines(driver_hoc_body)
         if model["run"] is not None:
             drv.writelines("\n".join(model["run"]))  # how to run the model
@@ -209,7 +555,10 @@ def build_quit_hoc(model):
 
 def select_mosinit(model):
     # look for `mosinit.hoc`. It could also be produced by `init` script above
-    mosfiles = glob.glob(model.model_dir + "/**/mosinit.hoc", recursive=True)
+    if model.manifest is not None:
+        mosfiles = manifest_mosinit(model.manifest, model.root_dir, model.model_dir)
+    else:
+        mosfiles = glob.glob(model.model_dir + "/**/mosinit.hoc", recursive=True)
     # prefer less-nested directories, then sort alphabetically
     mosfiles.sort(key=lambda x: (x.count(os.sep), x))
     if len(mosfiles):
@@ -227,7 +576,7 @@ def build_and_run_script(model):
         with open(os.path.join(model.model_dir, "script.tmp"), "w") as script:
             script.writelines("\n".join(model["script"]))
             script.flush()
-        run_commands(model, ["/bin/sh", "script.tmp"])
+        yield from run_commands(model, ["/bin/sh", "script.tmp"])
         model.run_info["script"] = model["script"]
 
 
@@ -240,24 +589,66 @@ def build_python_runfile(model):
     model.run_info["driver"] = ""
 
 
+def prepared_files(model):
+    """
+    Names of the files written into the model directory by the model run
+    """
+    return {
+        "driver.hoc",
+        "quit.hoc",
+        "script.tmp",
+        "model_run.py",
+        "gout",
+        NRN_RUN_LOG_FILE,
+        str(model.id) + ".yaml",
+    }
+
+
 def prepare_model(model):
+    # scripts can add, move or remove files: only trust the zip without one
+    if "script" not in model:
+        model._manifest = zip_manifest(model.id)
     # unzip model from cache
     with zipfile.ZipFile(
         os.path.join(MODELS_ZIP_DIR, str(model.id) + ".zip"), "r"
     ) as zip_ref:
         model_dir = os.path.join(
-            model.working_dir,
-            str(model.id),
+            model.root_dir,
             os.path.dirname(zip_ref.infolist()[0].filename),
         )
         model_run_info_file = os.path.join(model_dir, str(model.id) + ".yaml")
-        if model._inplace and os.path.isfile(model_run_info_file):
+        inplace = model._inplace
+        if inplace and model.scratch_dir is not None:
+            # rerun from the model files of the working directory; when only
+            # the artifacts of a scratch run were persisted, prepare it again
+            inplace = holds_model_files(
+                model.working_root, zip_ref, prepared_files(model)
+            )
+            if inplace:
+                rehydrate(model.working_root, model.root_dir)
+        if inplace and os.path.isfile(model_run_info_file):
             with open(model_run_info_file) as run_info_file:
                 model["run_info"] = yaml.load(run_info_file, yaml.Loader)
+            if model.scratch_dir is not None:
+                model["run_info"] = rebase_paths(
+                    model.run_info, model.working_root, model.root_dir
+                )
         else:
+            if model.scratch_dir is not None:
+                # leftovers of an interrupted run
+                shutil.rmtree(model.root_dir, ignore_errors=True)
             if model._clean and is_dir_non_empty(model_dir):
                 shutil.rmtree(model_dir)
-            zip_ref.extractall(os.path.join(model.working_dir, str(model.id)))
+            if model.extract_cache:
+                model._extract_cache_hit = extract_model(
+                    zip_ref,
+                    zip_key(model._model),
+                    model.root_dir,
+                    link="script" not in model,
+                    private=prepared_files(model),
+                )
+            else:
+                zip_ref.extractall(model.root_dir)
 
             # set model_dir
             model.run_info["model_dir"] = model_dir
@@ -266,7 +657,7 @@ def prepare_model(model):
             build_driver_hoc(model)
 
             # write and execute extra script if specified in the run instructions
-            build_and_run_script(model)
+            yield from build_and_run_script(model)
 
             # Determine init file: HOC or Python.
             # Python
@@ -283,8 +674,79 @@ def prepare_model(model):
                 yaml.dump(model.run_info, run_info_file, sort_keys=True)
 
 
+def fingerprint_gout(model, gout_file):
+    """
+    Record the hash and line summaries of the gout of a run (None when it
+    wrote no gout), for diffreports2html to skip unchanged models
+    """
+    if not os.path.isfile(gout_file):
+        model._fingerprint["gout_hash"] = None
+        return
+    try:
+        gout_hash, gout_summary = gout_fingerprint(gout_file)
+    except (GoutFormatError, ValueError):
+        append_log(model, model.logs, traceback.format_exc())
+        return
+    model._fingerprint["gout_hash"] = gout_hash
+    model._fingerprint["gout_summary"] = gout_summary
+    model._fingerprint["gout_format"] = model.gout_format
+
+
+def persist_model(model):
+    """
+    Copy the artifacts of a model run from its scratch directory to the
+    working directory, then delete the scratch directory
+    """
+    paths = [model.nrn_run.path]
+    if model.model_dir:
+        paths.append(os.path.join(model.model_dir, str(model.id) + ".yaml"))
+    start_dir = model.run_info.get("start_dir")
+    if start_dir:
+        paths.append(os.path.join(start_dir, "gout"))
+        if model._scratch_keep_build:
+            paths.append(os.path.join(start_dir, platform.machine()))
+    if not model._inplace:
+        shutil.rmtree(model.working_root, ignore_errors=True)
+    persist_artifacts(model.root_dir, model.working_root, paths)
+    model["run_info"] = rebase_paths(model.run_info, model.root_dir, model.working_root)
+    model.nrn_run.relocate(
+        rebase_paths(model.nrn_run.path, model.root_dir, model.working_root)
+    )
+    model_run_info_file = os.path.join(model.model_dir, str(model.id) + ".yaml")
+    if model.model_dir and os.path.isfile(model_run_info_file):
+        with open(model_run_info_file, "w") as run_info_file:
+            yaml.dump(model.run_info, run_info_file, sort_keys=True)
+    shutil.rmtree(model.root_dir, ignore_errors=True)
+
+
 def run_model(model):
+    if model.jobserver is None:
+        return run_steps(model, model_run_steps(model))
+    # hold a core for the whole model run; make borrows the spare ones
+    token = model.jobserver.acquire()
+    try:
+        return run_steps(model, model_run_steps(model))
+    finally:
+        model.jobserver.release(token)
+
+
+async def run_model_async(model):
+    # the jobserver tokens bound the number of concurrent model runs
+    token = await model.jobserver.acquire_async()
+    try:
+        return await run_steps_async(model, model_run_steps(model))
+    finally:
+        model.jobserver.release(token)
+
+
+def model_run_steps(model):
+    """
+    Prepare, compile and run `model`; the subprocesses are yielded as Command
+    objects to the driver of the run (see run_steps)
+    """
     start_time = time.perf_counter()
+    if model.timeout:
+        model._deadline = start_time + float(model.timeout)
     # Some models are skipped on purpose
     if "skip" in model:
         append_log(
@@ -299,7 +761,7 @@ def run_model(model):
 
     try:
         # prepare model
-        prepare_model(model)
+        yield from prepare_model(model)
 
         if model["run"] is None:
             append_log(
@@ -329,10 +791,13 @@ def run_model(model):
 
         else:
             top = model.run_info["start_dir"]
-            for root, _, __ in os.walk(top):
-                groups = find_modfile_group([root])
-                if groups:
-                    mod_groups.append(groups)
+            if model.manifest is not None:
+                mod_groups = manifest_mod_groups(model.manifest, model.root_dir, top)
+            else:
+                for root, _, __ in os.walk(top):
+                    groups = find_modfile_group([root])
+                    if groups:
+                        mod_groups.append(groups)
 
             if mod_groups:
                 for mod_group in mod_groups:
@@ -346,10 +811,8 @@ def run_model(model):
                 raise FileNotFoundError("No .mod file directory found")
         # compile mods if available
         if mod_groups:
-            # in case of reruns
-            clean_model_dir(model)
             # translate them to cpp
-            compile_mods(model, mod_groups)
+            yield from compile_mods(model, mod_groups)
 
     except Exception:  # noqa
         append_log(model, model.logs, traceback.format_exc())
@@ -362,6 +825,8 @@ def run_model(model):
     # run NEURON
     if "norun" in model:
         append_log(model, model.logs, "Model is not run due to --norun option")
+    elif model.timed_out:
+        append_log(model, model.logs, "Model is not run due to timeout")
     else:
         try:
             nrn_exe = (
@@ -379,18 +844,34 @@ def run_model(model):
             append_log(
                 model, model.nrn_run, "RUNNING -> {}".format(" ".join(model_run_cmds))
             )
-            run_neuron_cmds(model, model_run_cmds)
-            if os.path.isfile(os.path.join(model.model_dir, "gout")):
-                with open(os.path.join(model.model_dir, "gout"), "r") as gout:
-                    model._gout = gout.readlines()
+            yield from run_neuron_cmds(model, model_run_cmds)
+            gout_file = os.path.join(model.model_dir, "gout")
+            if model._report_gout and os.path.isfile(gout_file):
+                model._gout = gout_text_lines(gout_file)
+            fingerprint_gout(model, gout_file)
         except Exception:  # noqa
             append_log(model, model.nrn_run, traceback.format_exc())
-            if not model.get("ignore_exit_code", False):
+            if not model.get("ignore_exit_code", False) and not model.timed_out:
                 model._nrn_run_error = True
 
     stop_time = time.perf_counter()
     model._run_times["model"] = stop_time - start_time
 
+    try:
+        curation = curator(model.id)
+        model._fingerprint["nrn_run_curation"] = curation.key
+        model._fingerprint["nrn_run_curated_hash"] = curation.fingerprint(
+            model.nrn_run.all_lines()
+        )
+    except Exception:  # noqa
+        append_log(model, model.logs, traceback.format_exc())
+
+    if model.scratch_dir is not None:
+        try:
+            persist_model(model)
+        except Exception:  # noqa
+            append_log(model, model.logs, traceback.format_exc())
+
     # Record the total too (for backwards compatibility)
     model._run_time = str(sum(model._run_times.values()))
 
@@ -398,10 +879,32 @@ def run_model(model):
 
 
 class ModelRunManager(object):
-    def __init__(self, master_dir, gout=False, clean=False, norun=False, inplace=False):
+    def __init__(
+        self,
+        master_dir,
+        gout=False,
+        clean=False,
+        norun=False,
+        inplace=False,
+        build_cache=False,
+        object_cache=False,
+        extract_cache=False,
+        scratch=None,
+        scratch_keep_build=False,
+        gout_format="text",
+        jobs=None,
+        history=(),
+        timeout=None,
+        max_memory=None,
+        resume=False,
+        reuse_results=False,
+        shard=None,
+        runner="pool",
+    ):
         self.master_dir = master_dir
         self.logfile = str(master_dir) + ".log"
         self.dumpfile = str(master_dir) + ".json"
+        self.jsonlfile = str(master_dir) + ".jsonl"
         self._setup_logging()
         self.logger.info("Initialized -> logfile: " + self.logfile)
         self.run_logs = {}
@@ -409,6 +912,25 @@ class ModelRunManager(object):
         self._clean = clean
         self._norun = norun
         self._inplace = inplace
+        self._build_cache = build_cache
+        self._object_cache = object_cache
+        self._extract_cache = extract_cache
+        self._scratch = scratch
+        self._scratch_keep_build = scratch_keep_build
+        self._gout_format = gout_format
+        self._jobs = jobs or multiprocessing.cpu_count()
+        self._history = history
+        self._timeout = timeout
+        self._max_memory = max_memory
+        self._resume = resume
+        self._reuse_results = reuse_results
+        self._result_keys = {}
+        # (index, count) of the slice of the models run by this manager
+        self._shard = shard
+        # "pool": a multiprocessing.Pool of workers running the models
+        # "asyncio": asyncio subprocesses driven from this process
+        self._runner = runner
+        self._nrn_version = None
 
     def _setup_logging(self):
         self.logger = logging.getLogger("dev")
@@ -441,27 +963,113 @@ class ModelRunManager(object):
                     self.logger.error(
                         str(model_id) + "\n\t" + "\t".join(logs["nrn_run"])
                     )
+                if "timeout" in logs:
+                    self.logger.error(str(model_id) + " timed out")
 
     def _dump_run(self):
         self.logger.info("Dumping run logs to {} ...".format(self.dumpfile))
 
         # Run info, use key 0
         self.run_logs[0] = {}
-        from neuron import __version__ as nrn_ver
-
-        self.run_logs[0]["NEURON version"] = nrn_ver
+        self.run_logs[0]["NEURON version"] = self._nrn_version
         self.run_logs[0]["Stats"] = self._run_stats(self.run_logs)
+        if "Object cache" in self.run_logs[0]["Stats"]:
+            self.logger.info(
+                "Object cache: {Compilations avoided} compilations avoided, "
+                "{Compilations} compilations".format(
+                    **self.run_logs[0]["Stats"]["Object cache"]
+                )
+            )
 
         # Dump logs
         with open(self.dumpfile, "w+") as dump_file:
             json.dump(self.run_logs, dump_file, indent=4, sort_keys=True)
 
+    def _reuse_cached_results(self, model_ids, toolchain):
+        """
+        Take the results of the models whose inputs did not change from the
+        result cache; remember the keys of the others, to store their results
+        """
+        working_dir = os.path.abspath(self.master_dir)
+        options = {
+            "gout": self._gout,
+            "norun": self._norun,
+            "timeout": self._timeout,
+            "max_memory": self._max_memory,
+            # graphs record nothing without a display (e.g. no --virtual)
+            "display": bool(os.environ.get("DISPLAY")),
+        }
+        # not part of the key in text format, to keep the keys of older runs
+        if self._gout_format != "text":
+            options["gout_format"] = self._gout_format
+        reused = 0
+        with open(self.jsonlfile, "a") as jsonl_file:
+            for model_id in model_ids:
+                try:
+                    key = result_key(
+                        shared_modeldb().metadata[model_id],
+                        shared_modeldb().run_instr.get(model_id, {}),
+                        toolchain,
+                        options,
+                    )
+                except FileNotFoundError:
+                    continue
+                model_report = restore_result(key, working_dir)
+                if model_report is None:
+                    self._result_keys[model_id] = key
+                    continue
+                self.run_logs[model_id] = model_report
+                self._append_jsonl(jsonl_file, model_id)
+                reused += 1
+        self.logger.info(
+            "Reusing the results of {} models with unchanged inputs".format(reused)
+        )
+
+    def _load_jsonl(self):
+        """
+        Reports of the models completed by a previous (interrupted) run with the
+        same NEURON version, from the line-delimited report
+        """
+        run_logs = {}
+        if not os.path.isfile(self.jsonlfile):
+            return run_logs
+        line = "\n"
+        with open(self.jsonlfile) as jsonl_file:
+            for line in jsonl_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # last line of a killed run
+                    continue
+                if entry["NEURON version"] == self._nrn_version:
+                    run_logs[entry["id"]] = entry["report"]
+        if not line.endswith("\n"):
+            # terminate the partial line, so that new lines can be appended
+            with open(self.jsonlfile, "a") as jsonl_file:
+                jsonl_file.write("\n")
+        return run_logs
+
+    def _append_jsonl(self, jsonl_file, model_id):
+        jsonl_file.write(
+            json.dumps(
+                {
+                    "NEURON version": self._nrn_version,
+                    "id": model_id,
+                    "report": self.run_logs[model_id],
+                },
+                sort_keys=True,
+            )
+            + "\n"
+        )
+        jsonl_file.flush()
+
     @staticmethod
     def _run_stats(json_report):
         stats = {}
         stats["Total nof models run"] = len(json_report) - 1  # discard 0
         failed_mods = []
         failed_runs = []
+        timed_out_runs = []
         skipped_runs = []
 
         for model_id in json_report.keys():
@@ -470,9 +1078,11 @@ class ModelRunManager(object):
                 skipped_runs.append(model_id)
 
             # moderr happens if mods present and nrnivmodl failed
-            # if no moderr we look for nrn_run_err
+            # if no moderr we look for timeouts, then nrn_run_err
             if "moderr" in json_report[model_id]:
                 failed_mods.append(model_id)
+            elif "timeout" in json_report[model_id]:
+                timed_out_runs.append(model_id)
             elif "nrn_run_err" in json_report[model_id]:
                 failed_runs.append(model_id)
 
@@ -486,37 +1096,103 @@ class ModelRunManager(object):
             "Accession numbers": failed_runs,
         }
 
+        stats["Timed out runs"] = {
+            "Count": len(timed_out_runs),
+            "Accession numbers": timed_out_runs,
+        }
+
         stats["Skipped runs"] = {
             "Count": len(skipped_runs),
             "Accession numbers": skipped_runs,
         }
 
+        object_cache = [
+            json_report[model_id]["object_cache"]
+            for model_id in json_report.keys()
+            if "object_cache" in json_report[model_id]
+        ]
+        if object_cache:
+            stats["Object cache"] = {
+                "Compilations avoided": sum(item["hits"] for item in object_cache),
+                "Compilations": sum(item["misses"] for item in object_cache),
+            }
+
         return stats
 
-    def _run_models(self, model_runs):
-        pool = multiprocessing.Pool()
-
-        processed_models = pool.imap_unordered(run_model, model_runs)
-        for model in ProgressBar.iter(processed_models, self.nof_models):
-            self.run_logs[model.id] = {}
-            self.run_logs[model.id]["logs"] = model.logs
-            if self._gout:
-                self.run_logs[model.id]["gout"] = model.gout
-            self.run_logs[model.id]["nrn_run"] = model.nrn_run
-            if "skip" in model:
-                self.run_logs[model.id]["do_not_run"] = True
-            if model.nrn_run_error:
-                self.run_logs[model.id]["nrn_run_err"] = True
-            if model.get("ignore_exit_code", False):
-                self.run_logs[model.id]["ignore_exit_code"] = True
-            if model.no_mosinit_hoc:
-                self.run_logs[model.id]["no_mosinit_hoc"] = True
-            self.run_logs[model.id]["run_info"] = model.run_info
-            self.run_logs[model.id]["run_time"] = model.run_time
-            self.run_logs[model.id]["run_times"] = model.run_times
-            self.logger.debug(
-                "Done for: {} in {}".format(str(model.id), str(model.run_times))
+    def _model_report(self, model):
+        report = {}
+        report["logs"] = model.logs
+        if self._gout:
+            report["gout"] = model.gout
+        report["nrn_run"] = model.nrn_run.lines()
+        if model.nrn_run.nof_lines:
+            report["nrn_run_log"] = model.nrn_run.path
+            report["nrn_run_lines"] = model.nrn_run.nof_lines
+            report["nrn_run_hash"] = model.nrn_run.hash
+        if model.nrn_run.truncated:
+            report["nrn_run_truncated"] = True
+        report.update(model.fingerprint)
+        if "skip" in model:
+            report["do_not_run"] = True
+        if self._norun:
+            report["norun"] = True
+        if model.nrn_run_error:
+            report["nrn_run_err"] = True
+        if model.timed_out:
+            report["timeout"] = True
+        if model.get("ignore_exit_code", False):
+            report["ignore_exit_code"] = True
+        if model.no_mosinit_hoc:
+            report["no_mosinit_hoc"] = True
+        report["run_info"] = model.run_info
+        report["run_time"] = model.run_time
+        report["run_times"] = model.run_times
+        if model.build_cache is not None:
+            report["build_cache"] = model.build_cache_stats
+        if model.object_cache is not None:
+            report["object_cache"] = model.object_cache_stats
+        if model.extract_cache:
+            report["extract_cache_hit"] = model.extract_cache_hit
+        return report
+
+    def _model_done(self, jsonl_file, model):
+        self.run_logs[model.id] = self._model_report(model)
+        self._append_jsonl(jsonl_file, model.id)
+        # timeouts depend on the load of the machine
+        if model.id in self._result_keys and not model.timed_out:
+            store_result(
+                self._result_keys[model.id],
+                self.run_logs[model.id],
+                model.working_dir,
             )
+        self.logger.debug(
+            "Done for: {} in {}".format(str(model.id), str(model.run_times))
+        )
+
+    async def _run_models_async(self, model_runs, jsonl_file):
+        progress = ProgressBar(self.nof_models)
+
+        # --jobs workers pulling models in turn: the models waiting for a core
+        # are not started at all (no task, no file descriptor)
+        async def worker():
+            nonlocal progress
+            for model in model_runs:
+                self._model_done(jsonl_file, await run_model_async(model))
+                progress += 1
+
+        model_runs = iter(model_runs)
+        await asyncio.gather(*(worker() for _ in range(self._jobs)))
+
+    def _run_models(self, model_runs):
+        # every finished model is recorded right away, for --resume
+        with open(self.jsonlfile, "a") as jsonl_file:
+            if self._runner == "asyncio":
+                asyncio.run(self._run_models_async(model_runs, jsonl_file))
+            else:
+                pool = multiprocessing.Pool(self._jobs)
+                processed_models = pool.imap_unordered(run_model, model_runs)
+                for model in ProgressBar.iter(processed_models, self.nof_models):
+                    self._model_done(jsonl_file, model)
 
         self._grep_for_errors()
         self._dump_run()
@@ -528,27 +1204,108 @@ class ModelRunManager(object):
             self.logger.info("Creating master directory...")
             os.mkdir(self.master_dir)
 
+        if self._scratch is not None:
+            self.logger.info("Scratch directory is: " + self._scratch)
+            os.makedirs(self._scratch, exist_ok=True)
+
+        from neuron import __version__ as nrn_ver
+
+        self._nrn_version = nrn_ver
+
         # models selection
-        models_selected = (
-            ModelDB.metadata.values()
-            if model_list is None
-            else (ModelDB.metadata[k] for k in model_list)
+        model_ids = list(
+            shared_modeldb().metadata.keys() if model_list is None else model_list
         )
+        runtimes = expected_runtimes(model_ids, load_runtime_history(self._history))
+
+        if self._shard is not None:
+            index, count = self._shard
+            # the persisted history differs from one machine to the other: all
+            # shards partition the models from the same --history reports
+            shard_runtimes = expected_runtimes(
+                model_ids, load_runtime_history(self._history, persisted=False)
+            )
+            model_ids = shard(model_ids, shard_runtimes, index, count)
+            self.logger.info(
+                "Shard {}/{}: {} models".format(index + 1, count, len(model_ids))
+            )
+
+        if self._resume:
+            self.run_logs.update(
+                {
+                    model_id: model_report
+                    for model_id, model_report in self._load_jsonl().items()
+                    if model_id in model_ids
+                }
+            )
+            model_ids = [k for k in model_ids if k not in self.run_logs]
+            self.logger.info(
+                "Resuming: {} models already run with NEURON {}".format(
+                    len(self.run_logs), self._nrn_version
+                )
+            )
+        else:
+            # a new run starts a new line-delimited report
+            open(self.jsonlfile, "w").close()
+
+        # compiled mechanisms and results are only reused for the same NEURON
+        # and compilers
+        toolchain = (
+            toolchain_fingerprint()
+            if self._build_cache or self._object_cache or self._reuse_results
+            else None
+        )
+
+        if self._reuse_results:
+            self._reuse_cached_results(model_ids, toolchain)
+            model_ids = [k for k in model_ids if k not in self.run_logs]
+
+        # dispatch the longest models first, so that they do not end up running
+        # alone at the tail of the run
+        model_ids = longest_first(model_ids, runtimes)
+        models_selected = (shared_modeldb().metadata[k] for k in model_ids)
+
+        # core budget shared by model runs and nrnivmodl builds
+        jobserver = JobServer(self._jobs)
 
         # prepare ModelRun objects
         models_to_run = (
-            ModelRun(mdl, self.master_dir, self._clean, self._norun, self._inplace)
+            ModelRun(
+                mdl,
+                self.master_dir,
+                self._clean,
+                self._norun,
+                self._inplace,
+                build_cache=toolchain if self._build_cache else None,
+                object_cache=toolchain if self._object_cache else None,
+                jobserver=jobserver,
+                timeout=self._timeout,
+                max_memory=self._max_memory,
+                extract_cache=self._extract_cache,
+                scratch_dir=self._scratch,
+                scratch_keep_build=self._scratch_keep_build,
+                gout_format=self._gout_format,
+                report_gout=self._gout,
+            )
             for mdl in models_selected
         )
 
         # number of models
-        self.nof_models = (
-            len(ModelDB.metadata) if model_list is None else len(model_list)
-        )
+        self.nof_models = len(model_ids)
 
         self.logger.info("Running models ...")
         self.logger.info("\t\t-> number of models: " + str(self.nof_models))
-        self._run_models(models_to_run)
+        self.logger.info("\t\t-> number of cores: " + str(self._jobs))
+        self.logger.info(
+            "\t\t-> predicted wall-clock time: {:.0f} s".format(
+                predict_wall_time(model_ids, runtimes, self._jobs)
+            )
+        )
+        try:
+            self._run_models(models_to_run)
+        finally:
+            jobserver.close()
+        update_runtime_history(self.run_logs)
         self.logger.info("Done.")
 
 
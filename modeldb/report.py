@@ -1,60 +1,247 @@
+import contextlib
 import difflib
 import json
 import logging
+import multiprocessing
 import os
-import re
-import subprocess
 
 from pygments import highlight
 from pygments.formatters import HtmlFormatter
 from pygments.lexers import DiffLexer
+from pygments.lexers import TextLexer
 
-from .modeldb import ModelDB
+from .curation import curator
+from .gout import *
+from .modeldb import shared_modeldb
+from .modelrun import ModelRunManager
+from .runlog import read_run_log
 
 
-mdb = ModelDB()
+def curate_run_data(run_data, model=None):
+    return curator(model).curate(run_data)
 
 
-def curate_run_data(run_data, model=None):
-    curated_data = run_data
-
-    regex_dict = {
-        # /../nrniv: Assignment to modern physical constant FARADAY	<-> ./x86_64/special: Assignment to modern physical constant FARADAY
-        "^/.*?/nrniv:": "%neuron-executable%:",
-        "^\\./x86_64/special:": "%neuron-executable%:",
-        # nrniv: unable to open font "*helvetica-medium-r-normal*--14*", using "fixed" <-> special: unableto open font "*helvetica-medium-r-normal*--14*", using "fixed"
-        "^nrniv:": "%neuron-executable%:",
-        "^special:": "%neuron-executable%:",
-        "(Mon|Tue|Wed|Thu|Fri|Sat|Sun) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d+\s+\d+:\d+:\d+ [A-Z\s]+ \d+": "%date_command%",
-        "total run time [0-9\.]+": "total run time %run_time%",
-        "(^.*distutils.*$)": "",
-        "/.*?/lib/python.*/site-packages/": "%python-site-packages%",
+def gout_differences(gout_a_file, gout_b_file, atol=GOUT_ATOL, rtol=GOUT_RTOL):
+    """
+    Numeric differences between two gout files (see gout.compare_gout); a
+    missing file has no records
+    """
+    try:
+        records_a, records_b = (
+            read_gout(gout_file) if os.path.isfile(gout_file) else []
+            for gout_file in (gout_a_file, gout_b_file)
+        )
+    except (GoutFormatError, ValueError) as e:
+        return ["Cannot compare {} and {}: {}".format(gout_a_file, gout_b_file, e)]
+    return compare_gout(records_a, records_b, atol=atol, rtol=rtol)
+
+
+def merge_reports(json_reports, model_ids=None):
+    """
+    Combine the json reports of `runmodels` shards into a single report.
+
+    All reports must come from the same NEURON version; the run stats of the
+    "0" key are recomputed over all the models. The `model_ids` (default: all
+    the models of the metadata) found in none of the reports are listed in the
+    `Missing models` stats.
+    """
+    merged = {0: {}}
+    nrn_versions = set()
+    for json_report in json_reports:
+        with open(json_report) as report_file:
+            data = json.load(report_file)
+        nrn_versions.add(data["0"]["NEURON version"])
+        for model_id, model_report in data.items():
+            if int(model_id) == 0:
+                continue
+            if int(model_id) in merged:
+                logging.warning(
+                    "Model {} is present in several reports, keeping the one of {}".format(
+                        model_id, json_report
+                    )
+                )
+            merged[int(model_id)] = model_report
+    if len(nrn_versions) > 1:
+        raise Exception(
+            "Cannot merge reports of different NEURON versions: {}".format(
+                sorted(nrn_versions)
+            )
+        )
+    merged[0]["NEURON version"] = nrn_versions.pop()
+    merged[0]["Stats"] = ModelRunManager._run_stats(merged)
+    if model_ids is None:
+        model_ids = shared_modeldb().metadata.keys()
+    missing = sorted(set(model_ids) - set(merged) - {0})
+    if missing:
+        logging.warning(
+            "{} models are missing from all the reports: {}".format(
+                len(missing), missing
+            )
+        )
+    merged[0]["Stats"]["Missing models"] = {
+        "Count": len(missing),
+        "Accession numbers": missing,
     }
+    return merged
+
 
-    for model_specific_substitution in mdb.run_instr.get(model, {}).get(
-        "curate_patterns", []
+def load_nrn_run(report_entry):
+    """
+    The nrn_run lines of a report entry, read back from the run log when the
+    report only holds their head and tail (and the log is still around)
+    """
+    if "nrn_run_truncated" in report_entry and os.path.isfile(
+        report_entry["nrn_run_log"]
     ):
-        regex_dict[
-            model_specific_substitution["pattern"]
-        ] = model_specific_substitution["repl"]
-
-    for regex_key, regex_value in regex_dict.items():
-        updated_data = []
-        pattern = re.compile(regex_key)
-        for line in curated_data:
-            new_line, number_of_subs = pattern.subn(regex_value, line)
-            if number_of_subs:
-                logging.debug("{} matched {} time(s)".format(regex_key, number_of_subs))
-                logging.debug("{} -> {}".format(line, new_line))
-            # if we are replacing a full line with an empty string, don't add it to the curated data
-            if new_line:
-                updated_data.append(new_line)
-        curated_data = updated_data
-
-    return curated_data
-
-
-def diff_reports(report1_json, report2_json):
+        return read_run_log(report_entry["nrn_run_log"])
+    return report_entry["nrn_run"]
+
+
+def same_nrn_run(k, entry_a, entry_b):
+    """
+    Whether the report entries of model `k` have the same nrn_run, as told by
+    their hashes (of the raw output, or of the output curated by the current
+    curation patterns of the model)
+    """
+    hash_a = entry_a.get("nrn_run_hash")
+    if hash_a is not None and hash_a == entry_b.get("nrn_run_hash"):
+        return True
+    key = curator(int(k)).key
+    if not entry_a.get("nrn_run_curation") == entry_b.get("nrn_run_curation") == key:
+        return False
+    hash_a = entry_a.get("nrn_run_curated_hash")
+    return hash_a is not None and hash_a == entry_b.get("nrn_run_curated_hash")
+
+
+def same_gout(entry_a, entry_b):
+    """
+    Whether the report entries have the same gout, as told by their hashes
+    (reports older than the hashes are never the same)
+    """
+    return (
+        "gout_hash" in entry_a
+        and "gout_hash" in entry_b
+        and entry_a["gout_hash"] == entry_b["gout_hash"]
+    )
+
+
+def _speedup(a, b):
+    dict = {}
+    dict["v1"] = a
+    dict["v2"] = b
+    # compute slowdown/speedup relative to runtime_b (negative means slowdown)
+    dict["speedup"] = (float(b) - float(a)) / float(b) * 100
+    return dict
+
+
+def diff_model(k, entry_a, entry_b, gout_atol=GOUT_ATOL, gout_rtol=GOUT_RTOL):
+    """
+    Compare the report entries of model `k` (`entry_b` is None when the model
+    is missing from the second report).
+
+    Returns the HTML diffs of nrn_run and gout and the runtime comparison,
+    each None when there is nothing to report.
+    """
+    nrn_run_diff = gout_diff = runtimes = None
+    if entry_b is None:
+        ud_empty = difflib.unified_diff(
+            entry_a["nrn_run"],
+            ["Accession number {} not found in report2".format(k)],
+        )
+        nrn_run_diff = highlight(
+            "\n".join(ud_empty),
+            DiffLexer(),
+            HtmlFormatter(linenos=True, cssclass="colorful", full=True),
+        )
+        return nrn_run_diff, gout_diff, runtimes
+    # identical outputs need no curation
+    if same_nrn_run(k, entry_a, entry_b):
+        curated_a = curated_b = []
+    else:
+        curated_a = curate_run_data(load_nrn_run(entry_a), model=int(k))
+        curated_b = curate_run_data(load_nrn_run(entry_b), model=int(k))
+    start_dir_a = (
+        entry_a["run_info"]["start_dir"]
+        if "run_info" in entry_a and "start_dir" in entry_a["run_info"]
+        else "unknown"
+    )
+    start_dir_b = (
+        entry_b["run_info"]["start_dir"]
+        if "run_info" in entry_b and "start_dir" in entry_b["run_info"]
+        else "unknown"
+    )
+    if curated_a != curated_b:
+        ud = difflib.unified_diff(
+            curated_a, curated_b, fromfile=start_dir_a, tofile=start_dir_b
+        )
+        nrn_run_diff = highlight(
+            "\n".join(ud),
+            DiffLexer(),
+            HtmlFormatter(linenos=True, cssclass="colorful", full=True),
+        )
+
+    # List of keys that make gout comparison and speedup comparison pointless
+    skip_keys = {"do_not_run", "moderr", "nrn_run_err", "timeout"}
+    if skip_keys.isdisjoint(entry_a) and skip_keys.isdisjoint(entry_b):
+        # compare runtimes and compute slowdown or speedup
+        runtimes = {}
+        runtimes["total"] = _speedup(entry_a["run_time"], entry_b["run_time"])
+        for runkey in ("model", "nrnivmodl"):
+            if runkey in entry_a["run_times"] and runkey in entry_b["run_times"]:
+                runtimes[runkey] = _speedup(
+                    entry_a["run_times"][runkey],
+                    entry_b["run_times"][runkey],
+                )
+
+        # compare gout, unless the hashes tell it is the same
+        gout_a_file = os.path.join(entry_a["run_info"]["start_dir"], "gout")
+        gout_b_file = os.path.join(entry_b["run_info"]["start_dir"], "gout")
+        run_instr = shared_modeldb().run_instr.get(int(k), {})
+        atol = run_instr.get("gout_atol", gout_atol)
+        rtol = run_instr.get("gout_rtol", gout_rtol)
+        if same_gout(entry_a, entry_b):
+            differences = []
+        # gout may be missing in one of the paths: it then has no records
+        elif os.path.isfile(gout_a_file) or os.path.isfile(gout_b_file):
+            differences = gout_differences(
+                gout_a_file, gout_b_file, atol=atol, rtol=rtol
+            )
+        # the files are gone (e.g. reports of another machine): compare the
+        # line summaries of the reports
+        elif "gout_summary" in entry_a and "gout_summary" in entry_b:
+            differences = compare_gout_summaries(
+                entry_a["gout_summary"],
+                entry_b["gout_summary"],
+                atol=atol,
+                rtol=rtol,
+                compare_crc=entry_a.get("gout_format") == entry_b.get("gout_format"),
+            )
+        else:
+            differences = []
+        if differences:
+            gout_diff = highlight(
+                "\n".join(["--- " + gout_a_file, "+++ " + gout_b_file] + differences),
+                TextLexer(),
+                HtmlFormatter(linenos=True, cssclass="colorful", full=True),
+            )
+    return nrn_run_diff, gout_diff, runtimes
+
+
+def _diff_model(args):
+    return args[0], diff_model(*args)
+
+
+def diff_reports(
+    report1_json,
+    report2_json,
+    gout_atol=GOUT_ATOL,
+    gout_rtol=GOUT_RTOL,
+    jobs=None,
+):
+    """
+    Compare two json reports of runmodels. Models are compared by a pool of
+    `jobs` processes (default: number of CPUs), or in this process if 1.
+    """
     diff_dict = {}
     gout_dict = {}
     runtime_dict = {}
@@ -71,117 +258,40 @@ def diff_reports(report1_json, report2_json):
             json.dumps(data_b["0"], indent="\t").split("\n"),
         ).replace("\n", "")
         stats_dict = {v1: data_a["0"]["Stats"], v2: data_b["0"]["Stats"]}
-        for k in data_a.keys():
-            if int(k) == 0:
-                continue  # skip info key
-            if k not in data_b:
-                ud_empty = difflib.unified_diff(
-                    data_a[k]["nrn_run"],
-                    ["Accession number {} not found in report2".format(k)],
-                )
-                diff_dict[k] = highlight(
-                    "\n".join(ud_empty),
-                    DiffLexer(),
-                    HtmlFormatter(linenos=True, cssclass="colorful", full=True),
-                )
-                continue
-            curated_a = curate_run_data(data_a[k]["nrn_run"], model=int(k))
-            curated_b = curate_run_data(data_b[k]["nrn_run"], model=int(k))
-            start_dir_a = (
-                data_a[k]["run_info"]["start_dir"]
-                if "run_info" in data_a[k] and "start_dir" in data_a[k]["run_info"]
-                else "unknown"
-            )
-            start_dir_b = (
-                data_b[k]["run_info"]["start_dir"]
-                if "run_info" in data_b[k] and "start_dir" in data_b[k]["run_info"]
-                else "unknown"
-            )
-            if curated_a != curated_b:
-                ud = difflib.unified_diff(
-                    curated_a, curated_b, fromfile=start_dir_a, tofile=start_dir_b
-                )
-                diff_dict[k] = highlight(
-                    "\n".join(ud),
-                    DiffLexer(),
-                    HtmlFormatter(linenos=True, cssclass="colorful", full=True),
-                )
 
-            def _speedup(a, b):
-                dict = {}
-                dict["v1"] = a
-                dict["v2"] = b
-                # compute slowdown/speedup relative to runtime_b (negative means slowdown)
-                dict["speedup"] = (float(b) - float(a)) / float(b) * 100
-                return dict
-
-            # List of keys that make gout comparison and speedup comparison pointless
-            skip_keys = {"do_not_run", "moderr", "nrn_run_err"}
-            if skip_keys.isdisjoint(data_a[k]) and skip_keys.isdisjoint(data_b[k]):
-                # compare runtimes and compute slowdown or speedup
-                runtime_dict[k] = {}
-                runtime_dict[k]["total"] = _speedup(
-                    data_a[k]["run_time"], data_b[k]["run_time"]
-                )
-                for runkey in ("model", "nrnivmodl"):
-                    if (
-                        runkey in data_a[k]["run_times"]
-                        and runkey in data_b[k]["run_times"]
-                    ):
-                        runtime_dict[k][runkey] = _speedup(
-                            data_a[k]["run_times"][runkey],
-                            data_b[k]["run_times"][runkey],
-                        )
-
-                # compare gout
-                gout_a_file = os.path.join(data_a[k]["run_info"]["start_dir"], "gout")
-                gout_b_file = os.path.join(data_b[k]["run_info"]["start_dir"], "gout")
-                # gout may be missing in one of the paths. `diff -N` treats non-existent files as empty.
-                if os.path.isfile(gout_a_file) or os.path.isfile(gout_b_file):
-                    # https://stackoverflow.com/questions/1180606/using-subprocess-popen-for-process-with-large-output
-                    diff_cmd = [
-                        "diff",
-                        "-uN",
-                        "--speed-large-files",
-                        gout_a_file,
-                        gout_b_file,
-                    ]
-                    child = subprocess.Popen(
-                        diff_cmd,
-                        bufsize=1,  # line buffered
-                        stdout=subprocess.PIPE,  # we read from stdout below
-                        shell=False,
-                        text=True,
-                    )
-                    # sometimes when the results are wildly different then diff can ~hang
-                    timeout = 2  # seconds
-                    try:
-                        (diff_out, _) = child.communicate(timeout=timeout)
-                        diff_out = diff_out.splitlines()
-                        # maximum 30 lines to keep the summary diff page responsive
-                        if len(diff_out) > 30:
-                            diff_out = "\n".join(
-                                diff_out[:30]
-                                + [
-                                    "... {} lines suppressed ...".format(
-                                        len(diff_out) - 30
-                                    )
-                                ]
-                            )
-                        else:
-                            diff_out = "\n".join(diff_out)
-                    except subprocess.TimeoutExpired:
-                        child.kill()
-                        diff_out = (
-                            "{} did not complete in {} seconds, killing it".format(
-                                diff_cmd, timeout
-                            )
-                        )
-                    if diff_out:
-                        gout_dict[k] = highlight(
-                            diff_out,
-                            DiffLexer(),
-                            HtmlFormatter(linenos=True, cssclass="colorful", full=True),
-                        )
+    model_keys = [k for k in data_a.keys() if int(k) != 0]  # skip info key
+    # models whose hashes tell they are unchanged only compare their runtimes,
+    # right away; the workers only get the entries of the other models
+    unchanged = {
+        k
+        for k in model_keys
+        if k in data_b
+        and same_nrn_run(k, data_a[k], data_b[k])
+        and same_gout(data_a[k], data_b[k])
+    }
+    results = {
+        k: diff_model(k, data_a[k], data_b[k], gout_atol, gout_rtol)
+        for k in unchanged
+    }
+    model_entries = (
+        (k, data_a[k], data_b.get(k), gout_atol, gout_rtol)
+        for k in model_keys
+        if k not in unchanged
+    )
+    with contextlib.ExitStack() as stack:
+        if jobs == 1:
+            results.update(map(_diff_model, model_entries))
+        else:
+            pool = stack.enter_context(multiprocessing.Pool(jobs))
+            results.update(pool.imap(_diff_model, model_entries, chunksize=4))
+    # in the order of the models: the output is deterministic
+    for k in model_keys:
+        nrn_run_diff, gout_diff, runtimes = results[k]
+        if nrn_run_diff is not None:
+            diff_dict[k] = nrn_run_diff
+        if gout_diff is not None:
+            gout_dict[k] = gout_diff
+        if runtimes is not None:
+            runtime_dict[k] = runtimes
 
     return diff_dict, gout_dict, runtime_dict, stats_dict, v1, v2
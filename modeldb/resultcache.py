@@ -0,0 +1,133 @@
+"""
+Persistent cache of model run results, keyed by everything the result depends on.
+
+A model whose zip (`ver_date` and file), `modeldb-run.yaml` entry, NEURON build,
+run options and run driver (RESULT_SOURCES) did not change since a previous run
+gets the report entry of that run instead of being run again.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from .config import *
+
+RESULT_FILE = "result.json"
+
+# Sources of this package that prepare, build, run and report a model (down to
+# where its files come from): a change to any of them invalidates the cached
+# results
+RESULT_SOURCES = (
+    "buildcache.py",
+    "curation.py",
+    "extractcache.py",
+    "gout.py",
+    "hocscripts.py",
+    "modelrun.py",
+    "runlog.py",
+    "scratch.py",
+    "zipmanifest.py",
+)
+
+_working_dir_tag = "%working_dir%"
+
+
+@functools.lru_cache(maxsize=None)
+def sources_digest():
+    """sha256 of RESULT_SOURCES"""
+    sha = hashlib.sha256()
+    for source in RESULT_SOURCES:
+        with open(os.path.join(os.path.dirname(__file__), source), "rb") as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def result_key(model, run_instr, toolchain, options):
+    """
+    Fingerprint of the inputs of a model run
+    """
+    zip_stat = os.stat(os.path.join(MODELS_ZIP_DIR, "{}.zip".format(model.id)))
+    return hashlib.sha256(
+        json.dumps(
+            [
+                model.id,
+                model.last_modified,
+                # models fetched from GitHub can change with the same ver_date
+                zip_stat.st_size,
+                zip_stat.st_mtime_ns,
+                run_instr,
+                toolchain,
+                options,
+                sources_digest(),
+            ],
+            sort_keys=True,
+            default=str,
+        ).encode()
+    ).hexdigest()
+
+
+def rebase_paths(item, old, new):
+    """
+    `item` (a string or json-like structure) with `old` replaced by `new` in
+    all its strings, e.g. the paths of a report entry moved to another folder
+    """
+    if isinstance(item, str):
+        return item.replace(old, new)
+    if isinstance(item, dict):
+        return {key: rebase_paths(value, old, new) for key, value in item.items()}
+    if isinstance(item, list):
+        return [rebase_paths(value, old, new) for value in item]
+    return item
+
+
+def _result_paths(report):
+    # files kept along with the report entry: gout (in the start directory of
+    # the model) and the NEURON output log
+    paths = {}
+    if "start_dir" in report.get("run_info", {}):
+        paths["gout"] = os.path.join(report["run_info"]["start_dir"], "gout")
+    if "nrn_run_log" in report:
+        paths["nrn_run.log"] = report["nrn_run_log"]
+    return paths
+
+
+def store_result(key, report, working_dir):
+    """
+    Store the report entry of a model run in `working_dir` under `key`
+    """
+    os.makedirs(MODELS_RESULT_CACHE_DIR, exist_ok=True)
+    tmp_entry = tempfile.mkdtemp(dir=MODELS_RESULT_CACHE_DIR, prefix=".tmp-")
+    try:
+        for name, path in _result_paths(report).items():
+            if os.path.isfile(path):
+                shutil.copyfile(path, os.path.join(tmp_entry, name))
+        with open(os.path.join(tmp_entry, RESULT_FILE), "w") as result_file:
+            json.dump(rebase_paths(report, working_dir, _working_dir_tag), result_file)
+        entry = os.path.join(MODELS_RESULT_CACHE_DIR, key)
+        # replace the result of a previous run with the same inputs
+        shutil.rmtree(entry, ignore_errors=True)
+        os.rename(tmp_entry, entry)
+    except OSError:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+
+
+def restore_result(key, working_dir):
+    """
+    Report entry stored under `key`, with its files restored into `working_dir`.
+
+    Returns None on cache miss.
+    """
+    entry = os.path.join(MODELS_RESULT_CACHE_DIR, key)
+    if not os.path.isfile(os.path.join(entry, RESULT_FILE)):
+        return None
+    with open(os.path.join(entry, RESULT_FILE)) as result_file:
+        report = rebase_paths(json.load(result_file), _working_dir_tag, working_dir)
+    for name, path in _result_paths(report).items():
+        if os.path.isfile(os.path.join(entry, name)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(os.path.join(entry, name), path)
+    report["reused"] = True
+    return report
@@ -0,0 +1,184 @@
+"""
+Validated, cached index of the run instructions of MODELDB_RUN_FILE.
+
+The YAML file is checked against RUN_INSTRUCTION_SCHEMA when it is loaded, so
+that a typo fails `runmodels` right away rather than in the middle of a run.
+The result is pickled to MODELDB_RUN_INDEX_FILE and reused as long as the
+YAML file is unchanged (same mtime and size, or else same content).
+"""
+
+import os
+import pickle
+import re
+
+import yaml
+
+from .config import *
+from .data import file_sha256
+
+# Bumped whenever the layout of the index changes
+RUN_INDEX_VERSION = 1
+
+
+class RunInstructionsError(Exception):
+    """Run instructions that do not follow RUN_INSTRUCTION_SCHEMA"""
+
+
+def _is_str_list(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_curate_patterns(value):
+    if not isinstance(value, list):
+        return False
+    for item in value:
+        if not (
+            isinstance(item, dict)
+            and set(item) == {"pattern", "repl"}
+            and isinstance(item["pattern"], str)
+            and isinstance(item["repl"], str)
+        ):
+            return False
+        try:
+            re.compile(item["pattern"])
+        except re.error:
+            return False
+    return True
+
+
+# key -> (check, expected value)
+RUN_INSTRUCTION_SCHEMA = {
+    "comment": (lambda value: isinstance(value, str), "a string"),
+    "run": (
+        lambda value: value is None or _is_str_list(value),
+        "a list of strings or null",
+    ),
+    "script": (_is_str_list, "a list of strings"),
+    "model_dir": (_is_str_list, "a list of strings"),
+    "github": (
+        lambda value: isinstance(value, str)
+        and re.fullmatch(r"default|pull/\d+|/.+", value) is not None,
+        "`default`, `pull/<number>` or `/<organisation>`",
+    ),
+    "skip": (lambda value: isinstance(value, bool), "a boolean"),
+    "ignore_exit_code": (lambda value: isinstance(value, bool), "a boolean"),
+    "python": (lambda value: isinstance(value, bool), "a boolean"),
+    "hoc_stack_size": (
+        lambda value: isinstance(value, int) and not isinstance(value, bool),
+        "an integer",
+    ),
+    "timeout": (_is_number, "a number (seconds)"),
+    "max_memory": (_is_number, "a number (MB)"),
+    "gout_atol": (_is_number, "a number"),
+    "gout_rtol": (_is_number, "a number"),
+    "curate_patterns": (
+        _is_curate_patterns,
+        "a list of {pattern, repl} strings with valid regular expressions",
+    ),
+}
+
+
+def validate_run_instructions(run_instr, run_file=MODELDB_RUN_FILE):
+    """
+    Check `run_instr` against RUN_INSTRUCTION_SCHEMA, raise RunInstructionsError
+    listing all the problems found
+    """
+    errors = []
+    for model_id, instructions in run_instr.items():
+        if not isinstance(model_id, int):
+            errors.append("{!r}: model ids must be integers".format(model_id))
+            continue
+        if not isinstance(instructions, dict):
+            errors.append("{}: instructions must be a mapping".format(model_id))
+            continue
+        for key, value in instructions.items():
+            if key not in RUN_INSTRUCTION_SCHEMA:
+                errors.append("{}: unknown key `{}`".format(model_id, key))
+                continue
+            check, expected = RUN_INSTRUCTION_SCHEMA[key]
+            if not check(value):
+                errors.append(
+                    "{}: `{}` must be {}, got {!r}".format(model_id, key, expected, value)
+                )
+    if errors:
+        raise RunInstructionsError(
+            "Invalid run instructions in {}:\n\t{}".format(
+                run_file, "\n\t".join(errors)
+            )
+        )
+
+
+class RunInstructions(dict):
+    """Run instructions by model id, with their curate patterns compiled once"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._curate_patterns = {}
+
+    def curate_patterns(self, model_id):
+        """
+        Compiled `curate_patterns` of a model: {pattern: (regex, repl)}
+        """
+        if model_id not in self._curate_patterns:
+            self._curate_patterns[model_id] = {
+                item["pattern"]: (re.compile(item["pattern"]), item["repl"])
+                for item in self.get(model_id, {}).get("curate_patterns", [])
+            }
+        return self._curate_patterns[model_id]
+
+
+def _read_index(run_file, stat):
+    try:
+        with open(MODELDB_RUN_INDEX_FILE, "rb") as index_file:
+            index = pickle.load(index_file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+    if index.get("version") != RUN_INDEX_VERSION or index.get("file") != run_file:
+        return None
+    if index["stat"] == (stat.st_mtime_ns, stat.st_size):
+        return index
+    # touched (e.g. by a checkout) but maybe not modified
+    if index["sha256"] == file_sha256(run_file):
+        return index
+    return None
+
+
+def _write_index(index):
+    try:
+        os.makedirs(os.path.dirname(MODELDB_RUN_INDEX_FILE), exist_ok=True)
+        tmp_file = "{}.{}".format(MODELDB_RUN_INDEX_FILE, os.getpid())
+        with open(tmp_file, "wb") as index_file:
+            pickle.dump(index, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, MODELDB_RUN_INDEX_FILE)
+    except OSError:
+        pass  # the index is an optimisation only
+
+
+def load_run_instructions(run_file=MODELDB_RUN_FILE):
+    """
+    Validated run instructions of `run_file`, from the index when up to date
+    """
+    stat = os.stat(run_file)
+    index = _read_index(run_file, stat)
+    if index is None:
+        with open(run_file) as f:
+            run_instr = (
+                yaml.load(f, getattr(yaml, "CSafeLoader", yaml.SafeLoader)) or {}
+            )
+        validate_run_instructions(run_instr, run_file)
+        index = {
+            "version": RUN_INDEX_VERSION,
+            "file": run_file,
+            "stat": (stat.st_mtime_ns, stat.st_size),
+            "sha256": file_sha256(run_file),
+            "run_instr": run_instr,
+        }
+        _write_index(index)
+    elif index["stat"] != (stat.st_mtime_ns, stat.st_size):
+        index["stat"] = (stat.st_mtime_ns, stat.st_size)
+        _write_index(index)
+    return RunInstructions(index["run_instr"])
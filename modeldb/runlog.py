@@ -0,0 +1,123 @@
+"""Model run output streamed to disk, with a bounded in-memory capture"""
+
+import collections
+import contextlib
+import hashlib
+import os
+
+# Lines of the run output kept in memory (and in the json report)
+RUN_LOG_HEAD_LINES = 1000
+RUN_LOG_TAIL_LINES = 1000
+
+_suppressed_line = "... {} lines suppressed ..."
+
+
+class RunLog(object):
+    """Lines of a model run, written to `path` as they are produced.
+
+    Only the first `head` and last `tail` lines stay in memory, together with
+    the sha256 of the whole output (that is of the file at `path`), so that
+    arbitrarily chatty models do not grow the memory of the runner.
+    """
+
+    def __init__(self, path, head=RUN_LOG_HEAD_LINES, tail=RUN_LOG_TAIL_LINES):
+        self._path = path
+        self._nof_head = head
+        self._head = []
+        self._tail = collections.deque(maxlen=tail)
+        self._nof_lines = 0
+        self._sha = hashlib.sha256()
+        self._hash = None
+        self._file = None
+
+    path = property(lambda self: self._path)
+    nof_lines = property(lambda self: self._nof_lines)
+    truncated = property(
+        lambda self: self._nof_lines > len(self._head) + len(self._tail)
+    )
+    hash = property(
+        lambda self: self._sha.hexdigest() if self._sha is not None else self._hash
+    )
+
+    def __getstate__(self):
+        # the log is complete once the model is sent back to the runner
+        state = self.__dict__.copy()
+        state["_file"] = None
+        state["_sha"] = None
+        state["_hash"] = self.hash
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not self._nof_lines:
+            self._sha = hashlib.sha256()
+
+    def __iter__(self):
+        return iter(self.lines())
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        # a rerun in the same workdir starts a new log
+        return open(
+            self._path, "a" if self._nof_lines else "w", encoding="utf-8", newline=""
+        )
+
+    @contextlib.contextmanager
+    def streaming(self):
+        """Keep the log file open while appending many lines"""
+        self._file = self._open()
+        try:
+            yield self
+        finally:
+            self._file.close()
+            self._file = None
+
+    def extend(self, lines):
+        if self._sha is None:
+            # appending to an unpickled log: hash what is already written
+            with open(self._path, "rb") as log_file:
+                self._sha = hashlib.sha256(log_file.read())
+        if self._file is None:
+            with self.streaming():
+                self.extend(lines)
+            return
+        for line in lines:
+            self._file.write(line + "\n")
+            self._sha.update(line.encode() + b"\n")
+            if len(self._head) < self._nof_head:
+                self._head.append(line)
+            else:
+                self._tail.append(line)
+            self._nof_lines += 1
+
+    def append(self, line):
+        self.extend([line])
+
+    def relocate(self, path):
+        """Follow the log file, moved (or copied) to `path`"""
+        self._path = path
+
+    def lines(self):
+        """
+        The captured lines; suppressed lines are replaced by a marker
+        """
+        if not self.truncated:
+            return self._head + list(self._tail)
+        suppressed = self._nof_lines - len(self._head) - len(self._tail)
+        return self._head + [_suppressed_line.format(suppressed)] + list(self._tail)
+
+    def all_lines(self):
+        """
+        All the lines, read back from the log file when some were suppressed
+        """
+        if not self.truncated:
+            return self.lines()
+        return read_run_log(self._path)
+
+
+def read_run_log(path):
+    """
+    All the lines of the run log at `path`
+    """
+    with open(path, encoding="utf-8", newline="") as log_file:
+        return log_file.read().split("\n")[:-1]
@@ -0,0 +1,110 @@
+"""Scheduling of model runs based on the run times of previous runs"""
+
+import heapq
+import json
+import os
+import statistics
+
+from .config import *
+
+# Expected run time (in seconds) of a model when no run time is known at all
+DEFAULT_MODEL_RUNTIME = 10.0
+
+
+# Report keys of runs whose run time is not that of a complete run
+_incomplete_run_keys = {"do_not_run", "norun", "moderr", "nrn_run_err", "timeout"}
+
+
+def _runtime(model_report):
+    """Run time of a report entry, None when the run was not complete"""
+    if "run_time" not in model_report:
+        return None
+    if not _incomplete_run_keys.isdisjoint(model_report):
+        return None
+    return float(model_report["run_time"])
+
+
+def load_runtime_history(reports=(), persisted=True):
+    """
+    Collect the run time of every model, by model id.
+
+    The persisted history (MODELDB_RUNTIME_HISTORY_FILE, unless `persisted` is
+    False) is read first, then the json `reports`, later ones taking
+    precedence.
+    """
+    history = {}
+    if persisted and os.path.isfile(MODELDB_RUNTIME_HISTORY_FILE):
+        with open(MODELDB_RUNTIME_HISTORY_FILE) as history_file:
+            history.update(
+                {int(k): float(v) for k, v in json.load(history_file).items()}
+            )
+    for report in reports:
+        with open(report) as report_file:
+            data = json.load(report_file)
+        for model_id, model_report in data.items():
+            if int(model_id) != 0 and _runtime(model_report) is not None:
+                history[int(model_id)] = _runtime(model_report)
+    return history
+
+
+def update_runtime_history(json_report):
+    """
+    Persist the run times of `json_report` into MODELDB_RUNTIME_HISTORY_FILE;
+    skipped, failed and timed out runs keep their previous run time
+    """
+    history = load_runtime_history()
+    for model_id, model_report in json_report.items():
+        if int(model_id) != 0 and _runtime(model_report) is not None:
+            history[int(model_id)] = _runtime(model_report)
+    os.makedirs(os.path.dirname(MODELDB_RUNTIME_HISTORY_FILE), exist_ok=True)
+    with open(MODELDB_RUNTIME_HISTORY_FILE, "w") as history_file:
+        json.dump(history, history_file, indent=4, sort_keys=True)
+
+
+def expected_runtimes(model_ids, history):
+    """
+    Expected run time of every model in `model_ids`.
+
+    Models without history get the median of the known run times.
+    """
+    default = (
+        statistics.median(history.values()) if history else DEFAULT_MODEL_RUNTIME
+    )
+    return {model_id: history.get(model_id, default) for model_id in model_ids}
+
+
+def longest_first(model_ids, runtimes):
+    """
+    Order `model_ids` by decreasing expected run time (ties by model id)
+    """
+    return sorted(model_ids, key=lambda model_id: (-runtimes[model_id], model_id))
+
+
+def shard(model_ids, runtimes, index, count):
+    """
+    Models of shard `index` (0 based) out of `count` shards.
+
+    Models are assigned longest first to the shard with the least expected run
+    time so far (ties to the lowest shard), so every shard takes about the same
+    time. The partition only depends on `model_ids` and `runtimes`.
+    """
+    totals = [(0.0, i) for i in range(count)]
+    selected = []
+    for model_id in longest_first(model_ids, runtimes):
+        total, i = heapq.heappop(totals)
+        if i == index:
+            selected.append(model_id)
+        heapq.heappush(totals, (total + runtimes[model_id], i))
+    return selected
+
+
+def predict_wall_time(model_ids, runtimes, workers):
+    """
+    Simulate dispatching `model_ids` in order onto `workers` and return the
+    time at which the last model completes.
+    """
+    finish_times = [0.0] * min(workers, len(model_ids))
+    for model_id in model_ids:
+        # the next model goes to the first worker that becomes available
+        heapq.heapreplace(finish_times, finish_times[0] + runtimes[model_id])
+    return max(finish_times, default=0.0)
@@ -0,0 +1,45 @@
+"""
+Scratch directories: models prepared, compiled and run on fast local storage.
+
+With `runmodels --scratch=PATH`, a model works in `PATH/<model id>` and only
+the files its report refers to are copied back into `--workdir`. The scratch
+directory of the model is deleted afterwards.
+"""
+
+import os
+import shutil
+
+
+def persist_artifacts(scratch_root, working_root, paths):
+    """
+    Copy `paths` (files or directories below `scratch_root`) to the same
+    location below `working_root`
+    """
+    for path in paths:
+        dest = os.path.join(working_root, os.path.relpath(path, scratch_root))
+        if os.path.isdir(path):
+            shutil.copytree(path, dest, symlinks=True, dirs_exist_ok=True)
+        elif os.path.isfile(path):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copy2(path, dest)
+
+
+def rehydrate(working_root, scratch_root):
+    """
+    Copy the persisted model directory `working_root` to `scratch_root`
+    """
+    shutil.rmtree(scratch_root, ignore_errors=True)
+    if os.path.isdir(working_root):
+        shutil.copytree(working_root, scratch_root, symlinks=True)
+
+
+def holds_model_files(working_root, zip_ref, prepared_files):
+    """
+    Whether `working_root` holds the extracted model (e.g. from a run without
+    scratch directory) rather than only the persisted artifacts
+    """
+    return any(
+        os.path.isfile(os.path.join(working_root, info.filename))
+        for info in zip_ref.infolist()
+        if not info.is_dir() and os.path.basename(info.filename) not in prepared_files
+    )
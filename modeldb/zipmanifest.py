@@ -0,0 +1,119 @@
+"""
+Manifest of the content of a model zip, cached alongside the zip.
+
+It answers the questions asked while preparing a model (which directories
+hold mod files, where is `mosinit.hoc`) without walking the extracted tree,
+which is slow on network filesystems. It only describes the zip: models whose
+`script` can add, move or remove files still scan their directories.
+"""
+
+import json
+import os
+import zipfile
+from pathlib import Path
+
+from .config import *
+
+ZIP_MANIFEST_VERSION = 1
+
+
+def _manifest_file(model_id):
+    return os.path.join(MODELS_ZIP_DIR, "{}.manifest.json".format(model_id))
+
+
+def _is_hidden(name):
+    # glob.glob skips files and directories starting with a dot (Path.glob,
+    # used for mod files, does not)
+    return any(part.startswith(".") for part in name.split("/"))
+
+
+def build_manifest(zip_ref):
+    """
+    Directories, files (with their sizes), mod files by directory and
+    `mosinit.hoc` candidates of `zip_ref`, relative to the extraction root
+    """
+    files = {}
+    dirs = set()
+    for info in zip_ref.infolist():
+        name = info.filename.rstrip("/")
+        if not name:
+            continue
+        parent = os.path.dirname(name)
+        while parent:
+            dirs.add(parent)
+            parent = os.path.dirname(parent)
+        if info.is_dir():
+            dirs.add(name)
+        else:
+            files[name] = info.file_size
+    mod_dirs = {}
+    for name in sorted(files):
+        if name.endswith(".mod"):
+            mod_dirs.setdefault(os.path.dirname(name), []).append(name)
+    return {
+        "version": ZIP_MANIFEST_VERSION,
+        "dirs": sorted(dirs),
+        "files": files,
+        "mod_dirs": mod_dirs,
+        "mosinit": sorted(
+            name
+            for name in files
+            if os.path.basename(name) == "mosinit.hoc" and not _is_hidden(name)
+        ),
+    }
+
+
+def zip_manifest(model_id):
+    """
+    Manifest of the zip of `model_id`, rebuilt when the zip changed
+    """
+    zip_file = os.path.join(MODELS_ZIP_DIR, "{}.zip".format(model_id))
+    stat = os.stat(zip_file)
+    zip_stat = [stat.st_size, stat.st_mtime_ns]
+    try:
+        with open(_manifest_file(model_id)) as manifest_file:
+            manifest = json.load(manifest_file)
+        if (
+            manifest.get("version") == ZIP_MANIFEST_VERSION
+            and manifest.get("zip_stat") == zip_stat
+        ):
+            return manifest
+    except (OSError, ValueError):
+        pass
+    with zipfile.ZipFile(zip_file, "r") as zip_ref:
+        manifest = build_manifest(zip_ref)
+    manifest["zip_stat"] = zip_stat
+    tmp_file = "{}.{}".format(_manifest_file(model_id), os.getpid())
+    try:
+        with open(tmp_file, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(tmp_file, _manifest_file(model_id))
+    except OSError:
+        pass  # read-only cache: rebuilt next time
+    return manifest
+
+
+def _under(name, top):
+    return top in ("", ".") or name == top or name.startswith(top + "/")
+
+
+def manifest_mod_groups(manifest, root, top):
+    """
+    Mod files of every directory below `top`, as found by walking it top-down
+    """
+    top = os.path.relpath(top, root).replace(os.sep, "/")
+    return [
+        [Path(root, name) for name in manifest["mod_dirs"][mod_dir]]
+        for mod_dir in sorted(manifest["mod_dirs"], key=lambda item: item.split("/"))
+        if _under(mod_dir, top)
+    ]
+
+
+def manifest_mosinit(manifest, root, top):
+    """
+    Paths of the `mosinit.hoc` files below `top`
+    """
+    top = os.path.relpath(top, root).replace(os.sep, "/")
+    return [
+        os.path.join(root, name) for name in manifest["mosinit"] if _under(name, top)
+    ]
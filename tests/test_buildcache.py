@@ -0,0 +1,13 @@
+from modeldb.buildcache import mod_group_key
+
+
+def test_mod_group_key_covers_includes_outside_the_mod_dir(tmp_path):
+    (tmp_path / "mod").mkdir()
+    (tmp_path / "include").mkdir()
+    mod = tmp_path / "mod" / "cad.mod"
+    mod.write_text('NEURON { SUFFIX cad }\nINCLUDE "../include/units.inc"\n')
+    include = tmp_path / "include" / "units.inc"
+    include.write_text("UNITS { (mV) = (millivolt) }\n")
+    key = mod_group_key([mod], tmp_path, "toolchain")
+    include.write_text("UNITS { (mV) = (volt) }\n")
+    assert mod_group_key([mod], tmp_path, "toolchain") != key
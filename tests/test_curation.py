@@ -0,0 +1,54 @@
+import re
+
+from modeldb.curation import _default_patterns, model_curator
+
+
+def curate_per_pattern(patterns, lines):
+    # the former curation: a pass over all the lines per pattern
+    for _, (regex, repl) in patterns.items():
+        lines = [line for line in (regex.sub(repl, line) for line in lines) if line]
+    return lines
+
+
+def _compiled(patterns):
+    return {pattern: (re.compile(pattern), repl) for pattern, repl in patterns.items()}
+
+
+_lines = [
+    "/usr/local/bin/nrniv: Assignment to modern physical constant FARADAY",
+    "./x86_64/special: Assignment to modern physical constant FARADAY",
+    'nrniv: unable to open font "*helvetica-medium-r-normal*--14*", using "fixed"',
+    "Fri Oct 16 10:01:02 UTC 2026",
+    "total run time 12.345",
+    "/usr/lib/python3.11/distutils/__init__.py:1: DeprecationWarning",
+    "  /opt/venv/lib/python3.11/site-packages/neuron/__init__.py:42: warning",
+    "",
+    "t=0.025 v=-65.000000",
+    "first run: t=0.025 v=-64.5",
+    "seed 1234 done",
+]
+
+
+def test_default_patterns():
+    assert model_curator({}).curate(_lines) == curate_per_pattern(
+        _default_patterns, _lines
+    )
+
+
+def test_model_patterns():
+    model_patterns = _compiled(
+        {
+            # override of a default pattern
+            "total run time [0-9\\.]+": "run time",
+            "seed [0-9]+": "seed %seed%",
+            # delete lines
+            "^first run:.*$": "",
+            "v=-6[0-9]": "",
+        }
+    )
+    patterns = dict(_default_patterns)
+    patterns.update(model_patterns)
+    curated = model_curator(model_patterns).curate(_lines)
+    assert curated == curate_per_pattern(patterns, _lines)
+    assert "seed %seed% done" in curated
+    assert not any(line.startswith("first run") for line in curated)
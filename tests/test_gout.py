@@ -0,0 +1,31 @@
+import numpy as np
+
+from modeldb.gout import *
+
+
+def _records(y, x=None):
+    x = np.linspace(0, 1, len(y)) if x is None else np.asarray(x, dtype=float)
+    return [[GoutGraph("Graph[0]", [GoutLine(0, x, np.asarray(y, dtype=float))])]]
+
+
+def test_gout_fingerprint(tmp_path):
+    y = np.sin(np.linspace(0, 9, 1000))
+    write_binary_gout(_records(y), tmp_path / "a")
+    write_binary_gout(_records(y), tmp_path / "b")
+    write_binary_gout(_records(y * 1.01), tmp_path / "c")
+    hash_a, summary_a = gout_fingerprint(tmp_path / "a")
+    hash_b, summary_b = gout_fingerprint(tmp_path / "b")
+    hash_c, summary_c = gout_fingerprint(tmp_path / "c")
+    assert hash_a == hash_b and summary_a == summary_b
+    assert hash_a != hash_c
+    assert summary_a[0]["points"] == 1000
+    assert compare_gout_summaries(summary_a, summary_b) == []
+    assert len(compare_gout_summaries(summary_a, summary_c)) == 1
+
+
+def test_gout_fingerprint_text_and_binary(tmp_path):
+    # values with an exact %g representation
+    x, y = [0.0, 0.25, 0.5, 0.75], [0.5, -65.0, 1.25, 3.0]
+    write_text_gout(_records(y, x), tmp_path / "text")
+    write_binary_gout(_records(y, x), tmp_path / "binary")
+    assert gout_fingerprint(tmp_path / "text") == gout_fingerprint(tmp_path / "binary")
@@ -0,0 +1,47 @@
+import asyncio
+import os
+
+from modeldb.jobserver import JobServer
+
+
+def _open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+
+def test_acquire_async_shares_one_fd():
+    jobserver = JobServer(2)
+    open_fds = []
+
+    async def run():
+        async def hold():
+            token = await jobserver.acquire_async()
+            open_fds.append(_open_fds())
+            await asyncio.sleep(0)
+            jobserver.release(token)
+
+        # many more waiters than tokens
+        await asyncio.gather(*(hold() for _ in range(2000)))
+
+    try:
+        before = _open_fds()
+        asyncio.run(run())
+        assert len(open_fds) == 2000
+        # the event loop and the shared fifo end, not one per waiter
+        assert max(open_fds) <= before + 8
+    finally:
+        jobserver.close()
+
+
+def test_build_returns_tokens_of_killed_make():
+    jobserver = JobServer(4)
+    try:
+        token = jobserver.acquire()
+        with jobserver.build() as env:
+            # a make killed while holding all the tokens of its pipe
+            fd = os.open(env["MODELDB_JOBSERVER_FIFO"], os.O_RDWR)
+            assert len(os.read(fd, 16)) == 3
+            os.close(fd)
+        jobserver.release(token)
+        assert len(jobserver.try_acquire(16)) == 4
+    finally:
+        jobserver.close()
@@ -0,0 +1,31 @@
+import os
+
+import yaml
+
+from modeldb.data import Model
+from modeldb.metadatastore import MetadataStore
+
+
+def _write_yaml(path, models, mtime):
+    with open(path, "w") as yaml_file:
+        yaml.dump({model.id: model for model in models}, yaml_file)
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_yaml_import_keeps_updated_rows(tmp_path):
+    yaml_file = str(tmp_path / "meta.yaml")
+    db_file = str(tmp_path / "meta.db")
+    _write_yaml(yaml_file, [Model(1, "one", "2020", "2020-01-01")], 10**18)
+    store = MetadataStore(path=db_file, yaml_file=yaml_file)
+    assert store[1].last_modified == "2020-01-01"
+    # e.g. getmodels downloading a new version
+    store[1] = Model(1, "one", "2020", "2021-01-01", sha256="abc")
+    _write_yaml(
+        yaml_file,
+        [Model(1, "one", "2020", "2020-01-01"), Model(2, "two", "2020", "2020-01-01")],
+        2 * 10**18,
+    )
+    store = MetadataStore(path=db_file, yaml_file=yaml_file)
+    assert store[1].last_modified == "2021-01-01"
+    assert store[1].sha256 == "abc"
+    assert store[2].name == "two"
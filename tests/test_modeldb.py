@@ -0,0 +1,58 @@
+import http.server
+import json
+import threading
+
+import pytest
+
+from modeldb.modeldb import conditional_get_json
+
+
+class _CatalogueHandler(http.server.BaseHTTPRequestHandler):
+    etag = '"v1"'
+    body = [1, 2, 3]
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        payload = json.dumps(self.body).encode()
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def catalogue_url():
+    server = http.server.HTTPServer(("127.0.0.1", 0), _CatalogueHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}/models".format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def test_conditional_get_json(catalogue_url):
+    sync_state = {"queries": {}}
+    _CatalogueHandler.etag, _CatalogueHandler.body = '"v1"', [1, 2, 3]
+    _CatalogueHandler.requests = []
+    # 200: the response is stored along with its validator
+    assert conditional_get_json(catalogue_url, sync_state) == [1, 2, 3]
+    assert "If-None-Match" not in _CatalogueHandler.requests[-1]
+    assert sync_state["queries"][catalogue_url]["etag"] == '"v1"'
+    # 304: the stored response is returned
+    _CatalogueHandler.body = ["not", "sent"]
+    assert conditional_get_json(catalogue_url, sync_state) == [1, 2, 3]
+    assert _CatalogueHandler.requests[-1]["If-None-Match"] == '"v1"'
+    # 200 with a new validator: the stored response is replaced
+    _CatalogueHandler.etag = '"v2"'
+    assert conditional_get_json(catalogue_url, sync_state) == ["not", "sent"]
+    assert sync_state["queries"][catalogue_url]["etag"] == '"v2"'
@@ -0,0 +1,49 @@
+import json
+import types
+import zipfile
+
+import pytest
+
+from modeldb import modeldb, modelrun, schedule, zipmanifest
+from modeldb.data import Model
+from modeldb.metadatastore import MetadataStore
+from modeldb.modelrun import ModelRunManager
+from modeldb.runinstr import RunInstructions
+
+MODEL_ID = 99999
+
+
+@pytest.fixture
+def fixture_modeldb(tmp_path, monkeypatch):
+    """A ModelDB of a single model, with its metadata in SQLite"""
+    zip_dir = tmp_path / "cache"
+    zip_dir.mkdir()
+    with zipfile.ZipFile(zip_dir / "{}.zip".format(MODEL_ID), "w") as zip_ref:
+        zip_ref.writestr("model/mosinit.hoc", "create soma\n")
+    metadata = MetadataStore(
+        path=str(tmp_path / "meta.db"), yaml_file=str(tmp_path / "meta.yaml")
+    )
+    metadata[MODEL_ID] = Model(MODEL_ID, "fixture", "2020-01-01", "2020-01-01")
+    for module in (modelrun, zipmanifest):
+        monkeypatch.setattr(module, "MODELS_ZIP_DIR", str(zip_dir))
+    monkeypatch.setattr(
+        schedule, "MODELDB_RUNTIME_HISTORY_FILE", str(zip_dir / "history.json")
+    )
+    monkeypatch.setattr(
+        modeldb,
+        "_shared_modeldb",
+        types.SimpleNamespace(metadata=metadata, run_instr=RunInstructions()),
+    )
+    return metadata
+
+
+@pytest.mark.parametrize("runner", ["pool", "asyncio"])
+def test_runner(fixture_modeldb, tmp_path, runner):
+    pytest.importorskip("neuron")
+    workdir = tmp_path / "work"
+    # the models are looked up in the metadata store from the task feeder
+    # thread of the pool, after the main thread used it to list them
+    ModelRunManager(str(workdir), norun=True, jobs=1, runner=runner).run_models()
+    with open(str(workdir) + ".json") as report_file:
+        report = json.load(report_file)
+    assert str(MODEL_ID) in report
@@ -0,0 +1,28 @@
+import json
+
+from modeldb import schedule
+
+
+def test_update_runtime_history_skips_incomplete_runs(tmp_path, monkeypatch):
+    history_file = tmp_path / "history.json"
+    monkeypatch.setattr(schedule, "MODELDB_RUNTIME_HISTORY_FILE", str(history_file))
+    history_file.write_text(json.dumps({str(i): 100.0 for i in range(1, 7)}))
+    schedule.update_runtime_history(
+        {
+            "0": {},
+            "1": {"run_time": "1.0"},
+            "2": {"run_time": "2.0", "norun": True},
+            "3": {"run_time": "3.0", "timeout": True},
+            "4": {"run_time": "4.0", "moderr": ["error"]},
+            "5": {"run_time": "5.0", "nrn_run_err": True},
+            "6": {"run_time": "6.0", "do_not_run": True},
+        }
+    )
+    assert schedule.load_runtime_history() == {
+        1: 1.0,
+        2: 100.0,
+        3: 100.0,
+        4: 100.0,
+        5: 100.0,
+        6: 100.0,
+    }